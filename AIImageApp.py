@@ -1,18 +1,146 @@
 import sys
 import os
+import json
+import time
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QGridLayout, QCheckBox,
     QPushButton, QSlider, QFileDialog, QVBoxLayout, QHBoxLayout,
-    QScrollArea, QFrame
+    QScrollArea, QFrame, QProgressBar, QDialog, QPlainTextEdit
 )
-from PyQt5.QtGui import QPixmap, QDragEnterEvent, QDropEvent
-from PyQt5.QtCore import Qt, QMimeData
-from PIL import Image, ImageEnhance, ImageFilter
-import cv2
-import numpy as np
+from PyQt5.QtGui import QPixmap, QDragEnterEvent, QDropEvent, QFontDatabase
+from PyQt5.QtCore import Qt, QMimeData, QThread, QTimer, pyqtSignal
 from image_processing import ImageProcessing
+import batch
+from frame import Frame
+from adjustments import PREVIEW_SIDE, apply_adjustments
+from instrumentation import get_stage_registry
+from models import EYE_CASCADE, FACE_CASCADE, preload_models
+from selection import DEFAULT_WEIGHTS
+from similarity import SimilarityIndex
+from smart_crop import COMMON_RATIOS
+from thumbnails import THUMBNAIL_SIZE, ThumbnailService, load_thumbnail
+
+
+# ⑦ブレ、ピンボケ ⑧目瞑り ⑨顔の重なり ⑩類似写真
+SELECTION_TYPES = (7, 8, 9, 10)
+
+
+class BatchWorker(QThread):
+    """Runs jobs on the app's BatchExecutor off the GUI thread and reports each finished image.
+
+    Images whose outputs are already current for the same correction and settings are skipped.
+    `report` is always emitted, also when the batch itself fails.
+    """
+    progress = pyqtSignal(int, int, str)
+    report = pyqtSignal(object)
+
+    def __init__(self, executor, jobs, parent=None, prepare=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.jobs = jobs
+        self.prepare = prepare
+        # Reset here, not in run(), so a cancel during prepare or planning is kept.
+        self.executor.reset()
+
+    def run(self):
+        counts = {"completed": 0, "failed": 0}
+        started = time.perf_counter()
+
+        def on_result(result, done, total):
+            if result.error:
+                print(f"Failed to process {result.image_path}: {result.error}")
+            counts["failed" if result.error else "completed"] += 1
+            self.progress.emit(done + skipped, total + skipped, result.image_path)
+
+        skipped = 0
+        try:
+            if self.prepare is not None and not self.executor.cancelled:  # e.g. statistics over every image
+                self.jobs = self.prepare(self.jobs)
+            if not self.executor.cancelled:
+                plan = batch.plan_corrections(self.jobs)
+                skipped = len(plan.current)
+            if self.executor.cancelled:
+                report = batch.BatchReport(len(self.jobs), 0, 0, len(self.jobs), time.perf_counter() - started, 0.0)
+            else:
+                report = batch.run_incremental(self.executor, plan, on_result)
+        except Exception as exc:
+            print(f"Batch failed: {type(exc).__name__}: {exc}")
+            failed = len(self.jobs) - counts["completed"]
+            report = batch.BatchReport(len(self.jobs), counts["completed"], failed, 0,
+                                       time.perf_counter() - started, 0.0)
+        self.report.emit(report)
+
+    def cancel(self):
+        self.executor.cancel()
+
+
+class SelectionWorker(QThread):
+    """Extracts selection features (and similarity groups for ⑩) off the GUI thread."""
+    ready = pyqtSignal(int, object, object)
+
+    def __init__(self, engine, similarity_index, correction_type, image_paths, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.similarity_index = similarity_index
+        self.correction_type = correction_type
+        self.image_paths = image_paths
+
+    def run(self):
+        groups = None
+        if self.correction_type == 10:
+            groups = self.similarity_index.groups(self.image_paths)
+            self.engine.add(path for group in groups for path in group)
+        else:
+            self.engine.add(self.image_paths)
+        self.ready.emit(self.correction_type, self.image_paths, groups)
+
+
+class DebugPanel(QDialog):
+    """Shows where processing time went, per stage, and exports the recorded timings."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("デバッグ: 処理時間")
+        self.resize(760, 420)
+        layout = QVBoxLayout(self)
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        layout.addWidget(self.text)
+
+        buttons = QHBoxLayout()
+        for label, handler in (("更新", self.refresh), ("クリア", self.clear),
+                               ("Chrome traceを保存", self.save_chrome_trace),
+                               ("Prometheus形式で保存", self.save_prometheus)):
+            button = QPushButton(label)
+            button.clicked.connect(handler)
+            buttons.addWidget(button)
+        layout.addLayout(buttons)
+        self.refresh()
+
+    def refresh(self):
+        self.text.setPlainText(get_stage_registry().summary_table())
+
+    def clear(self):
+        get_stage_registry().clear()
+        self.refresh()
+
+    def save_chrome_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Chrome traceを保存", "trace.json", "JSON (*.json)")
+        if path:
+            with open(path, "w") as f:
+                json.dump(get_stage_registry().chrome_trace(), f)
+
+    def save_prometheus(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Prometheus形式で保存", "metrics.prom", "Text (*.prom *.txt)")
+        if path:
+            with open(path, "w") as f:
+                f.write(get_stage_registry().prometheus_text())
+
 
 class ImageApp(QWidget):
+    thumbnail_ready = pyqtSignal(int, object)
+
     def __init__(self):
         super().__init__()
 
@@ -28,11 +156,29 @@ class ImageApp(QWidget):
         # Add sliders for brightness, color, and contrast
         self.create_sliders()
 
+        # Ratios used by ⑥トリミング
+        self.create_ratio_options()
+
+        # Progress bar and cancel button for batch runs
+        self.create_progress_bar()
+
         # Set the main layout
         self.setLayout(self.main_layout)
         self.setWindowTitle("Photo Correction App")
         self.image_paths = []
         self.thumbnails = []
+        self.batch_worker = None
+        # One pool for the whole session: workers keep their imports and models between batches.
+        self.batch_executor = batch.BatchExecutor(preload=(FACE_CASCADE, EYE_CASCADE))
+        self.similarity_index = SimilarityIndex()
+        self.similar_image_groups = []
+        # Features are extracted once per image; changing selection_weights only re-ranks.
+        self.selection = ImageProcessing.selection_engine()
+        self.selection_weights = dict(DEFAULT_WEIGHTS)
+        self.selection_worker = None
+        self.thumbnail_service = ThumbnailService()
+        self.thumbnail_labels = []
+        self.thumbnail_ready.connect(self.set_thumbnail)
 
         # Enable drag and drop
         self.setAcceptDrops(True)
@@ -90,6 +236,29 @@ class ImageApp(QWidget):
         self.color_slider = self.create_slider("色を調整する")
         self.contrast_slider = self.create_slider("コントラストを調整する")
 
+        # Live preview of the three sliders on a screen-sized proxy of one selected image
+        preview_layout = QHBoxLayout()
+        self.preview_label = QLabel()
+        self.preview_label.setFixedSize(480, 320)
+        self.preview_label.setAlignment(Qt.AlignCenter)
+        self.preview_label.setStyleSheet("background-color: #333333;")
+        preview_layout.addWidget(self.preview_label)
+        apply_button = QPushButton("調整を適用する")
+        apply_button.setStyleSheet("font-size: 16px; background-color: #ADD8E6; margin: 5px;")
+        apply_button.clicked.connect(lambda: self.handle_correction(12))
+        preview_layout.addWidget(apply_button)
+        self.main_layout.addLayout(preview_layout)
+
+        self.preview_path = None
+        self.preview_proxy = None
+        # Debounce: slider moves restart the timer, the preview renders once movement pauses.
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(30)
+        self.preview_timer.timeout.connect(self.update_preview)
+        for slider in (self.brightness_slider, self.color_slider, self.contrast_slider):
+            slider.valueChanged.connect(lambda _: self.preview_timer.start())
+
     def create_slider(self, label_text):
         """Helper to create a labeled slider."""
         slider = QSlider(Qt.Horizontal)
@@ -101,116 +270,204 @@ class ImageApp(QWidget):
         self.main_layout.addWidget(slider)
         return slider
 
+    def create_ratio_options(self):
+        """Creates one checkbox per trimming ratio; every checked ratio is written as its own file."""
+        ratio_layout = QHBoxLayout()
+        label = QLabel("トリミング比率:")
+        label.setStyleSheet("font-size: 15px;")
+        ratio_layout.addWidget(label)
+        self.ratio_checkboxes = []
+        for text, ratio in COMMON_RATIOS:
+            checkbox = QCheckBox(text)
+            checkbox.setChecked(text == "16:9")
+            ratio_layout.addWidget(checkbox)
+            self.ratio_checkboxes.append((checkbox, ratio))
+        ratio_layout.addStretch()
+        self.main_layout.addLayout(ratio_layout)
+
+    def create_progress_bar(self):
+        """Creates the batch progress bar with its cancel button."""
+        progress_layout = QHBoxLayout()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("%v / %m")
+        self.cancel_button = QPushButton("キャンセル")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_batch)
+        debug_button = QPushButton("デバッグ")
+        debug_button.clicked.connect(self.show_debug_panel)
+        progress_layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.cancel_button)
+        progress_layout.addWidget(debug_button)
+        self.debug_panel = None
+        self.main_layout.addLayout(progress_layout)
+
     def add_images(self, files):
         for file in files:
             if os.path.isfile(file):
                 self.image_paths.append(file)
                 self.display_thumbnail(file)
+        self.preview_timer.start()
+
+    def update_preview(self):
+        """Renders the slider settings on the preview proxy of the first checked (or first) image."""
+        selected = [image_path for container, image_path in self.thumbnails
+                    if container.findChild(QCheckBox).isChecked()]
+        image_path = (selected or self.image_paths or [None])[0]
+        if image_path is None:
+            return
+        if image_path != self.preview_path:
+            self.preview_path = image_path
+            self.preview_proxy = Frame.from_pil(load_thumbnail(image_path, PREVIEW_SIDE))
+        settings = self.correction_settings()
+        preview = Frame(apply_adjustments(self.preview_proxy.array, settings["brightness"], settings["color"],
+                                          settings["contrast"], channel_order=self.preview_proxy.channel_order),
+                        self.preview_proxy.channel_order)
+        # fromImage copies the pixels, so the QImage view of the frame may go right after.
+        self.preview_label.setPixmap(QPixmap.fromImage(preview.to_qimage()).scaled(
+            self.preview_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
 
     def display_thumbnail(self, image_path):
-        row = len(self.image_paths) // 4
-        col = len(self.image_paths) % 4
-        pixmap = QPixmap(image_path).scaled(200, 200, Qt.KeepAspectRatio)
+        """Adds a placeholder tile right away and fills in the thumbnail once it is decoded."""
+        index = len(self.thumbnails)
+        row = index // 4
+        col = index % 4
 
         frame = QFrame()
         frame.setStyleSheet("background-color: #c1c2be; padding: 5px;")
 
-        image_label = QLabel()
-        image_label.setPixmap(pixmap)
+        image_label = QLabel("...")
+        image_label.setFixedSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        image_label.setAlignment(Qt.AlignCenter)
+        self.thumbnail_labels.append(image_label)
         image_widget = QVBoxLayout()
         image_widget.addWidget(image_label)
 
         checkbox = QCheckBox()
+        checkbox.stateChanged.connect(lambda _: self.preview_timer.start())
         image_widget.addWidget(checkbox)
 
         frame.setLayout(image_widget)
         self.grid_layout.addWidget(frame, row, col)
         self.thumbnails.append((frame, image_path))
 
+        # The callback runs on a worker thread; the signal hands the result to the GUI thread.
+        self.thumbnail_service.submit(
+            image_path,
+            lambda path, thumbnail, error: self.thumbnail_ready.emit(index, error or thumbnail))
+
+    def set_thumbnail(self, index, thumbnail):
+        label = self.thumbnail_labels[index]
+        if isinstance(thumbnail, Exception):
+            label.setText("×")
+            print(f"Could not load thumbnail for {self.thumbnails[index][1]}: {thumbnail}")
+            return
+        label.setPixmap(QPixmap.fromImage(Frame.from_pil(thumbnail).to_qimage()))
+
     def handle_correction(self, correction_type):
         """Handles the selected correction type."""
         print(f"Correction type {correction_type} selected.")
+        selected = [image_path for container, image_path in self.thumbnails
+                    if container.findChild(QCheckBox).isChecked()]
+        if correction_type in SELECTION_TYPES:  # ⑦-⑩ pick photos instead of writing new ones
+            self.start_selection(correction_type, selected or self.image_paths)
+            return
+        if self.batch_worker is not None and self.batch_worker.isRunning():
+            print("A batch is already running.")
+            return
+        if not selected:
+            return
+
+        settings = self.correction_settings()
+        jobs = [(image_path, correction_type, settings) for image_path in selected]
+        self.progress_bar.setRange(0, len(jobs))
+        self.progress_bar.setValue(0)
+        self.cancel_button.setEnabled(True)
+        # ② matches all selected photos to one shared exposure instead of equalizing each alone.
+        prepare = batch.with_exposure_target if correction_type == 2 else None
+        self.batch_worker = BatchWorker(self.batch_executor, jobs, self, prepare)
+        self.batch_worker.progress.connect(self.on_batch_progress)
+        self.batch_worker.report.connect(self.on_batch_finished)
+        self.batch_worker.start()
+
+    def start_selection(self, correction_type, image_paths):
+        if not image_paths or (self.selection_worker is not None and self.selection_worker.isRunning()):
+            return
+        self.selection_worker = SelectionWorker(self.selection, self.similarity_index, correction_type,
+                                                image_paths, self)
+        self.selection_worker.ready.connect(self.apply_selection)
+        self.selection_worker.start()
+
+    def apply_selection(self, correction_type, image_paths, groups):
+        """Ranks the photos with the already extracted features and checks the ones to keep."""
+        if correction_type == 7:  # Sharpest photo
+            weights = dict.fromkeys(DEFAULT_WEIGHTS, 0.0)
+            weights["sharpness"] = 1.0
+            keep = self.selection.rank([image_paths], weights)[0]
+        elif correction_type == 8:  # Photos without closed eyes
+            keep = ImageProcessing.remove_closed_eyes(image_paths, self.selection)
+        elif correction_type == 9:  # Photos with the least face overlap
+            keep = ImageProcessing.remove_face_overlap(image_paths, self.selection)
+        else:  # Best-quality photo of each group of similar ones
+            self.similar_image_groups = groups
+            best = self.selection.rank(groups, self.selection_weights, k=1)
+            for group, (best_image,) in zip(groups, best):
+                print(f"Best-quality image selected: {best_image} (out of {len(group)} similar photos)")
+            if not groups:
+                print("No similar photos found.")
+            rejected = {path for group in groups for path in group} - {path for (path,) in best}
+            keep = [path for path in image_paths if path not in rejected]
+        print(f"Selected {len(keep)} of {len(image_paths)} photos.")
+        keep = set(keep)
         for container, image_path in self.thumbnails:
-            if container.findChild(QCheckBox).isChecked():
-                self.apply_correction(image_path, correction_type)
+            if image_path in image_paths:
+                container.findChild(QCheckBox).setChecked(image_path in keep)
+
+    def correction_settings(self):
+        return {
+            "brightness": self.brightness_slider.value() / 100.0,
+            "color": self.color_slider.value() / 100.0,
+            "contrast": self.contrast_slider.value() / 100.0,
+            "aspect_ratios": [ratio for checkbox, ratio in self.ratio_checkboxes if checkbox.isChecked()] or None,
+        }
+
+    def on_batch_progress(self, done, total, image_path):
+        self.progress_bar.setValue(done)
+
+    def on_batch_finished(self, report):
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setValue(report.total - report.cancelled)
+        print(f"Processed {report.completed} images ({report.failed} failed, {report.cancelled} cancelled, "
+              f"{report.skipped} already up to date) "
+              f"in {report.elapsed:.2f}s, {report.throughput:.2f} images/s")
+        if self.debug_panel is not None and self.debug_panel.isVisible():
+            self.debug_panel.refresh()
+
+    def show_debug_panel(self):
+        if self.debug_panel is None:
+            self.debug_panel = DebugPanel(self)
+        self.debug_panel.refresh()
+        self.debug_panel.show()
+        self.debug_panel.raise_()
+
+    def cancel_batch(self):
+        if self.batch_worker is not None:
+            self.batch_worker.cancel()
 
     def apply_correction(self, image_path, correction_type):
-        image = Image.open(image_path)
-        output_dir = os.path.join(os.path.dirname(image_path), "processed")
-        os.makedirs(output_dir, exist_ok=True)
-        output_path = os.path.join(output_dir, os.path.basename(image_path))
-        
-        if correction_type == 1:  # Adjust exposure
-            enhancer = ImageEnhance.Brightness(image)
-            enhanced_image = enhancer.enhance(self.brightness_slider.value() / 100.0)
-        
-        elif correction_type == 2:  # Unify exposure
-            processor = ImageProcessing(image_path)
-            enhanced_image = Image.fromarray(processor.unify_exposure())
-        
-        elif correction_type == 3:  # Color correction
-            enhancer = ImageEnhance.Color(image)
-            enhanced_image = enhancer.enhance(self.color_slider.value() / 100.0)
-        
-        elif correction_type == 4:  # Horizontal correction (preserve persons)
-            processor = ImageProcessing(image_path)
-            enhanced_image = Image.fromarray(processor.horizontal_correction_no_crop())
-        
-        elif correction_type == 5:  # Horizontal correction (allow cropping)
-            processor = ImageProcessing(image_path)
-            enhanced_image = Image.fromarray(processor.horizontal_correction_crop())
-        
-        elif correction_type == 6:  # Aspect ratio trimming
-            aspect_ratio = 16 / 9  # Example: widescreen (adjust as needed)
-            processor = ImageProcessing(image_path)
-            enhanced_image = Image.fromarray(processor.crop_with_aspect_ratio(aspect_ratio))
-        
-        elif correction_type == 7:  # Blur and sharpness handling
-            processor = ImageProcessing(image_path)
-            blur_score = processor.evaluate_blur()
-            print(f"Image blur score: {blur_score}")
-            enhanced_image = image  # No changes made to the image
-        
-        elif correction_type == 8:
-            processor = ImageProcessing(image_path)
-            if not processor.filter_closed_eyes():
-                print("Image skipped due to closed eyes.")
-            enhanced_image = image
-        
-        elif correction_type == 9:
-            processor = ImageProcessing(image_path)
-            overlap_score = processor.detect_face_overlap()
-            if overlap_score > 0:  # You can set a threshold for acceptable overlap
-                print("Image skipped due to face overlap.")
-            enhanced_image = image
-        
-        elif correction_type == 10:  # Find best-quality photo among similar ones
-            # Assuming `similar_images` is a list of paths provided elsewhere
-            similar_images = self.similar_images_group  # Replace with actual source
-            best_image = ImageProcessing.find_best_quality(similar_images)
-            print(f"Best-quality image selected: {best_image}")
-        
-        elif correction_type == 11:  # Enhance resolution
-            processor = ImageProcessing(image_path)
-            enhanced_image = Image.fromarray(processor.enhance_resolution())
-        
-        else:  # Default to original image if type is unrecognized
-            print("Unrecognized correction type. Returning original image.")
-            enhanced_image = image
-
-        # Save the processed image
-        enhanced_image.save(output_path)
+        """Applies a single correction synchronously with the current slider settings."""
+        output_path = batch.apply_correction(image_path, correction_type, self.correction_settings())
         print(f"Processed image saved to: {output_path}")
 
-
-    def unify_exposure(self, image):
-        image_cv = np.array(image)
-        lab = cv2.cvtColor(image_cv, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-        cl = clahe.apply(l)
-        merged = cv2.merge((cl, a, b))
-        return Image.fromarray(cv2.cvtColor(merged, cv2.COLOR_LAB2RGB))
+    def closeEvent(self, event):
+        if self.batch_worker is not None and self.batch_worker.isRunning():
+            self.batch_worker.cancel()
+            self.batch_worker.wait()
+        if self.selection_worker is not None:
+            self.selection_worker.wait()
+        # Waiting for the thumbnails in progress keeps their callbacks from reaching a deleted window.
+        self.thumbnail_service.shutdown(wait=True)
+        self.batch_executor.close()
+        super().closeEvent(event)
 
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls():
@@ -223,6 +480,8 @@ class ImageApp(QWidget):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    if "--preload-models" in sys.argv:
+        preload_models()
     window = ImageApp()
     window.resize(1200, 800)
     window.show()
@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+
+PREVIEW_SIDE = 800
+
+# ITU-R 601 luma weights, the ones PIL uses for its "L" conversion
+LUMA_RGB = np.array([0.299, 0.587, 0.114])
+
+
+def luma_weights(channel_order="BGR"):
+    return LUMA_RGB[::-1] if channel_order == "BGR" else LUMA_RGB
+
+
+def mean_luma(image, channel_order="BGR"):
+    means = np.array(cv2.mean(image)[:3])
+    return float(means @ luma_weights(channel_order))
+
+
+def adjustment_matrix(brightness=1.0, color=1.0, contrast=1.0, luma=128.0, channel_order="BGR"):
+    """Returns the 3x4 affine transform equivalent to PIL's Brightness, Color and Contrast enhancers
+    applied in that order.
+
+    Color blends towards the per-pixel luma and Contrast towards the mean luma `luma` of the
+    original image; because Color keeps luma unchanged, the three steps collapse into a single
+    matrix and offset. It matches PIL to 1-2 levels only while no channel clips: PIL
+    clips to 0-255 after each enhancer, so pixels that saturate midway can differ by tens of
+    levels at strong settings. Preview and saved file both use this transform and agree.
+    """
+    weights = luma_weights(channel_order)
+    color_matrix = color * np.eye(3) + (1 - color) * np.outer(np.ones(3), weights)
+    matrix = np.empty((3, 4))
+    matrix[:, :3] = contrast * brightness * color_matrix
+    matrix[:, 3] = (1 - contrast) * brightness * luma
+    return matrix
+
+
+def apply_adjustments(image, brightness=1.0, color=1.0, contrast=1.0, luma=None, channel_order="BGR"):
+    """Applies brightness, color and contrast to a uint8 3-channel image in one pass.
+
+    Pass `luma` (see mean_luma) to render a full-resolution image exactly like its preview proxy.
+    """
+    if brightness == color == contrast == 1.0:
+        return image
+    if luma is None:
+        luma = mean_luma(image, channel_order)
+    matrix = adjustment_matrix(brightness, color, contrast, luma, channel_order)
+    return cv2.transform(image, matrix)
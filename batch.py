@@ -0,0 +1,515 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+from adjustments import PREVIEW_SIDE, apply_adjustments, mean_luma
+from exposure import exposure_target
+from frame import Frame
+from image_cache import get_image_cache
+from image_processing import ImageProcessing
+from instrumentation import get_stage_registry, stage
+from manifest import JobPlan, atomic_output
+from models import EYE_CASCADE, FACE_CASCADE, SUPERRES_MODEL, preload_models
+from smart_crop import parse_ratio, ratio_label
+
+
+# aspect_ratios, when set, trims to every listed ratio in one pass instead of just aspect_ratio.
+# exposure_target, when set, is the shared luma CDF unify_exposure matches every image to.
+DEFAULT_SETTINGS = {"brightness": 1.0, "color": 1.0, "contrast": 1.0, "aspect_ratio": 16 / 9, "aspect_ratios": None,
+                    "exposure_target": None}
+OUTPUT_FORMATS = {"jpg": ".jpg", "jpeg": ".jpg", "png": ".png", "webp": ".webp", "tiff": ".tiff"}
+
+# Models each correction type needs, so pool workers can load them before the first job.
+CORRECTION_MODELS = {
+    6: (FACE_CASCADE, EYE_CASCADE),
+    8: (FACE_CASCADE, EYE_CASCADE),  # eyes are searched inside detected faces (face_analysis)
+    9: (FACE_CASCADE, EYE_CASCADE),
+    11: (SUPERRES_MODEL,),
+}
+
+# Settings each correction type reads; only these decide whether an earlier output is still valid.
+CORRECTION_SETTINGS = {
+    1: ("brightness",),
+    2: ("exposure_target",),
+    3: ("color",),
+    6: ("aspect_ratio", "aspect_ratios"),
+    12: ("brightness", "color", "contrast"),
+}
+
+JobResult = namedtuple("JobResult", "image_path output_path error elapsed")
+# skipped counts jobs whose outputs were already current (see manifest.JobPlan)
+BatchReport = namedtuple("BatchReport", "total completed failed cancelled elapsed throughput skipped", defaults=(0,))
+
+
+def output_dir_for(image_path, output_dir=None):
+    return output_dir or os.path.join(os.path.dirname(image_path), "processed")
+
+
+def output_path_for(image_path, output_dir=None, output_format=None):
+    output_dir = output_dir_for(image_path, output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    if output_format is None:
+        return os.path.join(output_dir, os.path.basename(image_path))
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(output_dir, stem + OUTPUT_FORMATS[output_format.lower()])
+
+
+def apply_correction(image_path, correction_type, settings=None):
+    """Applies one correction to an image and saves it under processed/. Returns the output path."""
+    decoded = get_image_cache().get(image_path)
+    enhanced_image = correct_image(image_path, decoded, correction_type, settings)
+    return save_image(enhanced_image, output_path_for(image_path))
+
+
+def correct_image(image_path, decoded, correction_type, settings=None):
+    """Runs one correction on the decoded BGR image of `image_path` and returns the result as a Frame.
+
+    Trimming to several ratios returns {ratio label: Frame} instead.
+    """
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    image = Frame(decoded, "BGR")
+    with stage(f"correction:{correction_type}"):
+        return _correct(image_path, image, correction_type, settings)
+
+
+def save_image(frame, output_path):
+    """Saves a Frame, or each Frame of a {label: Frame} dict as <stem>_<label>; returns the path(s)."""
+    if isinstance(frame, dict):
+        stem, ext = os.path.splitext(output_path)
+        return [save_image(item, f"{stem}_{label}{ext}") for label, item in frame.items()]
+    with stage("encode") as record, atomic_output(output_path) as tmp_path:
+        frame.save(tmp_path)
+        record.nbytes = os.path.getsize(tmp_path)
+    return output_path
+
+
+def correction_params(job):
+    image_path, correction_type, settings = job
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    params = {"correction": correction_type}
+    params.update((name, settings[name]) for name in CORRECTION_SETTINGS.get(correction_type, ()))
+    return params
+
+
+def plan_corrections(jobs, force=False, dry_run=False):
+    """JobPlan for apply_correction jobs; the manifest lives in each image's processed/ directory."""
+    return JobPlan(jobs, lambda job: output_dir_for(job[0]), correction_params, force, create=not dry_run)
+
+
+def run_incremental(executor, plan, on_result=None):
+    """Runs the pending jobs of a JobPlan on `executor`, recording each finished one in its manifest."""
+    def record(result, done, total):
+        plan.record(result)
+        if on_result is not None:
+            on_result(result, done, total)
+
+    report = executor.run(plan.pending, record)
+    return report._replace(total=report.total + len(plan.current), skipped=len(plan.current))
+
+
+def with_exposure_target(jobs):
+    """Adds the exposure target shared by all images to unify-exposure jobs (path, 2, settings)."""
+    jobs = list(jobs)
+    if len(jobs) < 2:
+        return jobs
+    target = exposure_target([job[0] for job in jobs]).tolist()
+    settings = dict(jobs[0][2] or {}, exposure_target=target)
+    return [(job[0], job[1], settings) for job in jobs]
+
+
+def _decode_job(job):
+    return get_image_cache().get(job[0])
+
+
+def _correct_job(job, decoded):
+    try:
+        return correct_image(job[0], decoded, *job[1:])
+    finally:
+        # The cache entry and its derived views are not needed once corrected; dropping them keeps
+        # StagedExecutor within its queue bounds rather than the cache budget.
+        get_image_cache().invalidate(job[0])
+
+
+def _save_job(job, image):
+    return save_image(image, output_path_for(job[0]))
+
+
+# StagedExecutor stages for apply_correction jobs
+CORRECTION_STAGES = (_decode_job, _correct_job, _save_job)
+
+
+def _correct(image_path, image, correction_type, settings):
+    if correction_type in (1, 3, 12):  # Adjust exposure, color correction, or all sliders at once
+        # Same fused kernel and proxy mean as the slider preview, so the saved file matches it.
+        luma = mean_luma(get_image_cache().proxy(image_path, PREVIEW_SIDE))
+        factors = {
+            1: {"brightness": settings["brightness"]},
+            3: {"color": settings["color"]},
+            12: {name: settings[name] for name in ("brightness", "color", "contrast")},
+        }[correction_type]
+        adjusted = apply_adjustments(get_image_cache().get(image_path), luma=luma, **factors)
+        enhanced_image = Frame(adjusted, "BGR")
+
+    elif correction_type == 2:  # Unify exposure
+        processor = ImageProcessing(image_path)
+        if settings["exposure_target"] is not None:
+            enhanced_image = Frame(processor.match_exposure(settings["exposure_target"]), "BGR")
+        else:
+            enhanced_image = Frame(processor.unify_exposure(), "BGR")
+
+    elif correction_type == 4:  # Horizontal correction (preserve persons)
+        processor = ImageProcessing(image_path)
+        enhanced_image = Frame(processor.horizontal_correction_no_crop(), "BGR")
+
+    elif correction_type == 5:  # Horizontal correction (allow cropping)
+        processor = ImageProcessing(image_path)
+        enhanced_image = Frame(processor.horizontal_correction_crop(), "BGR")
+
+    elif correction_type == 6:  # Aspect ratio trimming
+        processor = ImageProcessing(image_path)
+        ratios = settings["aspect_ratios"] or (settings["aspect_ratio"],)
+        crops = processor.crop_with_aspect_ratios(ratios)
+        if len(crops) == 1:
+            enhanced_image = Frame(crops[ratios[0]], "BGR")
+        else:
+            enhanced_image = {ratio_label(ratio): Frame(crop, "BGR") for ratio, crop in crops.items()}
+
+    elif correction_type == 7:  # Blur and sharpness handling
+        processor = ImageProcessing(image_path)
+        print(f"Image blur score: {processor.evaluate_blur()}")
+        enhanced_image = image
+
+    elif correction_type == 8:
+        processor = ImageProcessing(image_path)
+        if not processor.filter_closed_eyes():
+            print("Image skipped due to closed eyes.")
+        enhanced_image = image
+
+    elif correction_type == 9:
+        processor = ImageProcessing(image_path)
+        if processor.detect_face_overlap() > 0:  # You can set a threshold for acceptable overlap
+            print("Image skipped due to face overlap.")
+        enhanced_image = image
+
+    elif correction_type == 11:  # Enhance resolution
+        processor = ImageProcessing(image_path)
+        enhanced_image = Frame(processor.enhance_resolution(), "BGR")
+
+    else:  # Default to original image if type is unrecognized
+        print("Unrecognized correction type. Returning original image.")
+        enhanced_image = image
+    return enhanced_image
+
+
+def _run_chunk(task, chunk):
+    # Stage timings recorded in the worker travel back with the results.
+    results = []
+    for job in chunk:
+        image_path = job[0]
+        started = time.perf_counter()
+        try:
+            output_path = task(*job)
+            error = None
+        except Exception as exc:
+            output_path, error = None, f"{type(exc).__name__}: {exc}"
+        finally:
+            # No later job in this worker reads the same image, so its frame and views are dropped
+            # instead of filling the worker's cache up to its budget.
+            get_image_cache().invalidate(image_path)
+        results.append(JobResult(image_path, output_path, error, time.perf_counter() - started))
+    return results, get_stage_registry().drain()
+
+
+class BatchExecutor:
+    """Runs correction jobs on a process pool, streaming per-image results back to the caller.
+
+    Each job is a tuple of arguments for `task`, whose first element is the image path and
+    which returns the output path. `task` must be a module-level function so it can be pickled.
+    `preload` lists models (see models.preload_models) each worker loads when it starts.
+
+    The pool is started by the first run and kept for the next ones, so workers keep their
+    imports and loaded models between batches; close() stops it.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=None, task=apply_correction, preload=()):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.task = task
+        self.preload = tuple(preload)
+        self._cancel_event = threading.Event()
+        self._pool = None
+
+    def cancel(self):
+        """Stops the current batch; stays in effect, also for later runs, until reset()."""
+        self._cancel_event.set()
+
+    def reset(self):
+        """Clears a cancel(); call it when a new batch is started, before any preparation."""
+        self._cancel_event.clear()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            context = multiprocessing.get_context("spawn")
+            initializer = preload_models if self.preload else None
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                             initializer=initializer, initargs=(self.preload,))
+        return self._pool
+
+    def chunks(self, jobs):
+        # Small chunks keep progress updates and cancellation responsive, larger ones
+        # amortize the inter-process round-trip on big batches.
+        size = self.chunk_size or max(1, min(8, len(jobs) // (self.max_workers * 4)))
+        return [jobs[i:i + size] for i in range(0, len(jobs), size)]
+
+    def run(self, jobs, on_result=None):
+        """Runs the jobs and returns a BatchReport.
+
+        `on_result(result, done, total)` is called in the calling thread as each image finishes.
+        """
+        jobs = list(jobs)
+        pending_chunks = self.chunks(jobs)
+        pending_chunks.reverse()
+        completed = failed = done = 0
+        started = time.perf_counter()
+
+        pool = self._get_pool()
+        in_flight = {}  # future -> chunk
+        broken = None
+        while pending_chunks or in_flight:
+            # Only keep a couple of chunks queued per worker so cancel() takes effect quickly.
+            while pending_chunks and len(in_flight) < self.max_workers * 2 and not self.cancelled and not broken:
+                chunk = pending_chunks.pop()
+                in_flight[pool.submit(_run_chunk, self.task, chunk)] = chunk
+            if self.cancelled:
+                for future in in_flight:
+                    future.cancel()
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk = in_flight.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    results, events = future.result()
+                    get_stage_registry().extend(events)
+                except BrokenProcessPool as exc:
+                    # A worker died (e.g. out of memory). The pool is unusable: its jobs and the
+                    # ones not submitted yet fail, and the next run starts a new pool.
+                    broken = f"{type(exc).__name__}: {exc}"
+                    results = [JobResult(job[0], None, broken, 0.0) for job in chunk]
+                for result in results:
+                    done += 1
+                    if result.error:
+                        failed += 1
+                    else:
+                        completed += 1
+                    if on_result is not None:
+                        on_result(result, done, len(jobs))
+        if broken:
+            self._pool = None
+            pool.shutdown(wait=False)
+            for chunk in pending_chunks:
+                for job in chunk:
+                    done += 1
+                    failed += 1
+                    if on_result is not None:
+                        on_result(JobResult(job[0], None, broken, 0.0), done, len(jobs))
+
+        elapsed = time.perf_counter() - started
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        return BatchReport(len(jobs), completed, failed, len(jobs) - done, elapsed, throughput)
+
+
+class StagedExecutor:
+    """Runs jobs through decode, compute and encode thread pools connected by bounded queues.
+
+    Reading and writing files overlap with OpenCV work on other images (OpenCV and the codecs
+    release the GIL). `stages` is (decode(job), compute(job, frame), encode(job, result)), where
+    encode returns the output path. At most `queue_depth` frames wait between two stages, so
+    memory is bounded by about 2 * queue_depth + the number of threads decoded frames.
+    """
+
+    def __init__(self, stages, compute_workers=None, io_workers=2, queue_depth=4):
+        self.stages = stages
+        self.compute_workers = compute_workers or os.cpu_count() or 1
+        self.io_workers = io_workers
+        self.queue_depth = queue_depth
+        self._cancel_event = threading.Event()
+
+    def cancel(self):
+        """Stops the current batch; stays in effect, also for later runs, until reset()."""
+        self._cancel_event.set()
+
+    def reset(self):
+        """Clears a cancel(); call it when a new batch is started, before any preparation."""
+        self._cancel_event.clear()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def close(self):
+        pass  # Its threads only live for one run.
+
+    def run(self, jobs, on_result=None):
+        """Runs the jobs and returns a BatchReport; `on_result` works as in BatchExecutor.run."""
+        jobs = list(jobs)
+        decode, compute, encode = self.stages
+        pending = queue.Queue()
+        decoded = queue.Queue(self.queue_depth)
+        computed = queue.Queue(self.queue_depth)
+        finished = queue.Queue()
+        for job in jobs:
+            pending.put([job, None, None, None])
+
+        threads = (self._start(decode, pending, decoded, self.io_workers, self.compute_workers, first=True)
+                   + self._start(compute, decoded, computed, self.compute_workers, self.io_workers)
+                   + self._start(encode, computed, finished, self.io_workers, 1, last=True))
+        for _ in range(self.io_workers):
+            pending.put(None)
+
+        completed = failed = done = 0
+        started = time.perf_counter()
+        while True:
+            result = finished.get()
+            if result is None:
+                break
+            done += 1
+            if result.error:
+                failed += 1
+            else:
+                completed += 1
+            if on_result is not None:
+                on_result(result, done, len(jobs))
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - started
+        throughput = done / elapsed if elapsed > 0 else 0.0
+        return BatchReport(len(jobs), completed, failed, len(jobs) - done, elapsed, throughput)
+
+    def _start(self, func, source, sink, workers, sink_workers, first=False, last=False):
+        # Items are [job, value, error, started]; the last stage turns them into JobResults.
+        # Every thread stops at a None from `source`, and the last one to stop passes one None
+        # per thread on to the next stage.
+        running = [workers]
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                item = source.get()
+                if item is None:
+                    break
+                job, value, error, job_started = item
+                if first:
+                    if self.cancelled:
+                        continue
+                    job_started = time.perf_counter()
+                if error is None:
+                    try:
+                        value = func(job) if first else func(job, value)
+                    except Exception as exc:
+                        value, error = None, f"{type(exc).__name__}: {exc}"
+                if last:
+                    sink.put(JobResult(job[0], value, error, time.perf_counter() - job_started))
+                else:
+                    sink.put([job, value, error, job_started])
+            with lock:
+                running[0] -= 1
+                stopped = running[0] == 0
+            if stopped:
+                for _ in range(sink_workers):
+                    sink.put(None)
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+
+def add_run_options(parser):
+    """Adds the executor and incremental-run options shared by this CLI and the pipeline's."""
+    parser.add_argument("--overlap-io", action="store_true",
+                        help="decode, correct and save on separate threads so file I/O overlaps computation")
+    parser.add_argument("--io-threads", type=int, default=2, help="decoder and encoder threads with --overlap-io")
+    parser.add_argument("--queue-depth", type=int, default=4,
+                        help="images waiting between stages with --overlap-io (bounds memory)")
+    parser.add_argument("--force", action="store_true", help="reprocess images whose outputs are already current")
+    parser.add_argument("--dry-run", action="store_true", help="only list the images that would be processed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply one correction to a batch of images.")
+    parser.add_argument("images", nargs="+", help="image files to process")
+    parser.add_argument("-c", "--correction", type=int, required=True, help="correction type (1-12)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--independent-exposure", action="store_true",
+                        help="with -c 2, equalize each image on its own instead of matching the whole set")
+    add_run_options(parser)
+    parser.add_argument("--brightness", type=float, default=DEFAULT_SETTINGS["brightness"])
+    parser.add_argument("--color", type=float, default=DEFAULT_SETTINGS["color"])
+    parser.add_argument("--contrast", type=float, default=DEFAULT_SETTINGS["contrast"])
+    parser.add_argument("--aspect-ratio", nargs="+", type=parse_ratio, default=[DEFAULT_SETTINGS["aspect_ratio"]],
+                        help="trimming ratios, e.g. 16:9 4:3 1:1 (one file per ratio)")
+    args = parser.parse_args(argv)
+
+    settings = {"brightness": args.brightness, "color": args.color, "contrast": args.contrast,
+                "aspect_ratios": args.aspect_ratio}
+    jobs = [(path, args.correction, settings) for path in args.images if os.path.isfile(path)]
+    if args.correction == 2 and not args.independent_exposure:
+        jobs = with_exposure_target(jobs)
+
+    plan = plan_corrections(jobs, args.force, args.dry_run)
+    if args.dry_run:
+        print_plan(plan)
+        return 0
+
+    if args.overlap_io:
+        executor = StagedExecutor(CORRECTION_STAGES, args.workers, args.io_threads, args.queue_depth)
+    else:
+        executor = BatchExecutor(args.workers, args.chunk_size, preload=CORRECTION_MODELS.get(args.correction, ()))
+    try:
+        report = run_incremental(executor, plan, report_progress)
+    finally:
+        executor.close()
+    print_report(report)
+    return 1 if report.failed else 0
+
+
+def report_progress(result, done, total):
+    status = f"failed ({result.error})" if result.error else result.output_path
+    print(f"[{done}/{total}] {result.image_path} -> {status}")
+
+
+def print_plan(plan):
+    for job in plan.pending:
+        print(f"would process {job[0]} ({plan.reasons[job[0]]})")
+    print(f"{len(plan.pending)} to process, {len(plan.current)} up to date")
+
+
+def print_report(report):
+    print(f"{report.completed} processed, {report.failed} failed, {report.skipped} up to date "
+          f"in {report.elapsed:.2f}s ({report.throughput:.2f} images/s)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Compares the original float64 full-frame blur score with the proxy-based int16 score.
+
+    python benchmarks/bench_blur.py --sizes 2000x1500 6000x4000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_cache import downscale  # noqa: E402
+from sharpness import SHARPNESS_SIDE, focus_map, sharpness  # noqa: E402
+
+
+def float64_variance(image):
+    # The original evaluate_blur.
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var()
+
+
+def proxy_variance(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return sharpness(downscale(gray, SHARPNESS_SIDE))
+
+
+def proxy_focus_map(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return focus_map(downscale(gray, SHARPNESS_SIDE))
+
+
+def measure(func, images):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for image in images:
+        func(image)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"images_per_second": len(images) / elapsed, "peak_mb": peak / 2**20}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["2000x1500", "6000x4000"], help="WIDTHxHEIGHT")
+    parser.add_argument("--count", type=int, default=4, help="images per size")
+    parser.add_argument("--json", default=None, help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    results = []
+    for size in args.sizes:
+        w, h = (int(v) for v in size.lower().split("x"))
+        images = [cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (0, 0), 1 + i)
+                  for i in range(args.count)]
+        for name, func in (("float64_full", float64_variance), ("int16_proxy", proxy_variance),
+                           ("focus_map", proxy_focus_map)):
+            row = dict(size=size, method=name, **measure(func, images))
+            results.append(row)
+            print(f"{size:>10} {name:>13}: {row['images_per_second']:7.1f} images/s  peak {row['peak_mb']:8.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compares the old two-warp padded rotation with ImageProcessing.rotate_bound.
+
+    python benchmarks/bench_rotation.py --sizes 2000x1500 6000x4000 --angle 3.5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_processing import ImageProcessing  # noqa: E402
+
+
+def padded_rotation(image, angle):
+    # The original horizontal_correction_no_crop: rotate in place, then add_padding.
+    h, w = image.shape[:2]
+    rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1)
+    rotated = cv2.warpAffine(image, rotation_matrix, (w, h))
+    return ImageProcessing.add_padding(None, rotated, angle)
+
+
+def measure(func, image, angle, repeat):
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = func(image, angle)
+        timings.append(time.perf_counter() - started)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        shape = result.shape
+        del result
+    return {"seconds": min(timings), "peak_mb": peak / 2**20, "output_shape": list(shape)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["2000x1500", "6000x4000"], help="WIDTHxHEIGHT")
+    parser.add_argument("--angle", type=float, default=3.5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", default=None, help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    results = []
+    for size in args.sizes:
+        w, h = (int(v) for v in size.lower().split("x"))
+        image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        for name, func in (("padded", padded_rotation), ("rotate_bound", ImageProcessing.rotate_bound)):
+            row = dict(size=size, method=name, **measure(func, image, args.angle, args.repeat))
+            results.append(row)
+            print(f"{size:>10} {name:>13}: {row['seconds'] * 1000:9.1f} ms  "
+                  f"peak {row['peak_mb']:8.1f} MB  output {row['output_shape']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Times every ImageProcessing method and apply_correction path on synthetic photos.
+
+    python benchmarks/run.py --sizes 1 12 --repeat 3 --json results.json
+    python benchmarks/run.py --sizes 1 12 --compare baseline.json
+
+Each case records the best and mean wall time, the peak RSS while it ran (Linux resets the
+high-water mark through /proc/self/clear_refs) and the tracemalloc peak of one extra traced run.
+Caches and the metrics store are bypassed so every run does the full work.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import batch  # noqa: E402
+from image_cache import get_image_cache  # noqa: E402
+from image_processing import ImageProcessing  # noqa: E402
+from synthetic import SIZES, generate_dataset  # noqa: E402
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def method_cases():
+    """(name, input photo, function of a fresh ImageProcessing) for every ImageProcessing method."""
+    def processor(image):
+        return ImageProcessing.from_array(image)
+
+    return [
+        ("detect_skew_angle", "horizon", lambda image: processor(image).detect_skew_angle()),
+        ("detect_skew_angle[accurate]", "horizon", lambda image: processor(image).detect_skew_angle("accurate")),
+        ("horizontal_correction_no_crop", "horizon", lambda image: processor(image).horizontal_correction_no_crop()),
+        ("horizontal_correction_crop", "horizon", lambda image: processor(image).horizontal_correction_crop()),
+        ("add_padding", "horizon", lambda image: processor(image).add_padding(image, 3.0)),
+        ("crop_with_aspect_ratio", "horizon", lambda image: processor(image).crop_with_aspect_ratio(16 / 9)),
+        ("unify_exposure", "horizon", lambda image: processor(image).unify_exposure()),
+        ("evaluate_blur", "sharp", lambda image: processor(image).evaluate_blur()),
+        ("evaluate_blur[full]", "sharp", lambda image: processor(image).evaluate_blur(full_resolution=True)),
+        ("analyze_faces", "faces", lambda image: processor(image).analyze_faces()),
+        ("filter_closed_eyes", "faces", lambda image: processor(image).filter_closed_eyes()),
+        ("detect_face_overlap", "faces", lambda image: processor(image).detect_face_overlap()),
+        ("enhance_resolution", "faces", lambda image: processor(image).enhance_resolution()),
+    ]
+
+
+# Button number -> name of the apply_correction path (10 is a group operation, timed separately).
+CORRECTIONS = {1: "exposure", 2: "unify_exposure", 3: "color", 4: "skew_no_crop", 5: "skew_crop",
+               6: "trim", 7: "blur", 8: "closed_eyes", 9: "face_overlap", 11: "super_resolution",
+               12: "adjust"}
+CORRECTION_INPUTS = {2: "horizon", 4: "horizon", 5: "horizon", 7: "sharp", 8: "faces", 9: "faces"}
+
+
+def run_case(func, repeat):
+    timings = []
+    reset_peak_rss()
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    rss = peak_rss_mb()
+    tracemalloc.start()
+    func()
+    alloc_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"best_seconds": min(timings), "mean_seconds": sum(timings) / len(timings),
+            "peak_rss_mb": rss, "alloc_peak_mb": alloc_peak / 2**20, "repeat": repeat}
+
+
+def fresh(func):
+    # Drop decoded images and derived views so path-based cases pay for decoding every time.
+    def wrapped():
+        get_image_cache().invalidate()
+        return func()
+    return wrapped
+
+
+def run(sizes, repeat, data_dir, only=None, max_padding_mp=24):
+    ImageProcessing.use_metrics_store = False
+    results = []
+    for mp in sizes:
+        paths = generate_dataset(data_dir, [mp])
+        images = {kind: cv2.imread(paths[f"{kind}_{mp}mp"]) for kind in ("horizon", "sharp", "faces")}
+        cases = [("decode", lambda p=paths[f"horizon_{mp}mp"]: cv2.imread(p))]
+        for name, kind, func in method_cases():
+            if name == "add_padding" and mp > max_padding_mp:
+                continue  # The padded canvas of a 50MP photo needs several GB.
+            cases.append((name, lambda f=func, image=images[kind]: f(image)))
+        for correction, name in CORRECTIONS.items():
+            path = paths[f"{CORRECTION_INPUTS.get(correction, 'horizon')}_{mp}mp"]
+            cases.append((f"apply_correction[{correction}:{name}]",
+                          fresh(lambda c=correction, p=path: batch.apply_correction(p, c))))
+        group = [paths[f"{kind}_{mp}mp"] for kind in ("sharp", "blurred", "faces", "faces_closed")]
+        cases.append(("find_best_quality", fresh(lambda g=group: ImageProcessing.find_best_quality(g))))
+        cases.append(("remove_closed_eyes", fresh(lambda g=group: ImageProcessing.remove_closed_eyes(g))))
+
+        for name, func in cases:
+            if only and not any(pattern in name for pattern in only):
+                continue
+            try:
+                row = run_case(func, repeat)
+            except Exception as exc:
+                row = {"error": f"{type(exc).__name__}: {exc}"}
+            row.update(case=name, megapixels=mp, size="x".join(map(str, SIZES[mp])))
+            results.append(row)
+            if "error" in row:
+                print(f"{mp:>3}MP {name:<40} skipped ({row['error'].splitlines()[0][:60]})")
+            else:
+                print(f"{mp:>3}MP {name:<40} {row['best_seconds'] * 1000:9.1f} ms  "
+                      f"rss {row['peak_rss_mb']:8.1f} MB  alloc {row['alloc_peak_mb']:8.1f} MB")
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(row["case"], row["megapixels"]): row for row in json.load(f)["results"] if "error" not in row}
+    print(f"\nCompared with {baseline_path} (ratio new/old, < 1 is better):")
+    for row in results:
+        old = baseline.get((row["case"], row["megapixels"]))
+        if old is None or "error" in row:
+            continue
+        print(f"{row['megapixels']:>3}MP {row['case']:<40} time x{row['best_seconds'] / old['best_seconds']:5.2f}  "
+              f"alloc x{row['alloc_peak_mb'] / max(old['alloc_peak_mb'], 1e-6):5.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1, 12], choices=sorted(SIZES), help="megapixels")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", default=None, help="run only cases whose name contains one of these")
+    parser.add_argument("--data-dir", default=None, help="where to write the synthetic photos (default: temp dir)")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.sizes, args.repeat, args.data_dir or tmp, args.only)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": metadata(), "results": results}, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Deterministic synthetic photos for benchmarking ImageProcessing without a real photo set.
+
+    python benchmarks/synthetic.py out_dir --sizes 1 12 24
+"""
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+# Megapixels -> (width, height) at 3:2
+SIZES = {mp: (int(round((mp * 1e6 * 1.5) ** 0.5)), int(round((mp * 1e6 / 1.5) ** 0.5)))
+         for mp in (1, 6, 12, 24, 50)}
+
+
+def _texture(rng, h, w, scale):
+    # Smooth noise upsampled from a coarse grid reads as foliage or clouds at any resolution.
+    coarse = rng.random((max(2, h // scale), max(2, w // scale), 3)).astype(np.float32)
+    return cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC)
+
+
+def horizon(width, height, angle=3.0, seed=0):
+    """Sky over ground with a horizon and a few parallel structures, rotated by `angle` degrees."""
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:height // 2] = (210, 170, 120)
+    image[height // 2:] = (60, 110, 70)
+    detail = (_texture(rng, height, width, 64) * 60).astype(np.uint8)
+    image = cv2.add(image, detail)
+    thickness = max(2, width // 500)
+    for k in range(1, 6):
+        y = height // 2 + k * height // 14
+        cv2.line(image, (0, y), (width, y), (235, 235, 235), thickness)
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1)
+    return cv2.warpAffine(image, rotation, (width, height), borderMode=cv2.BORDER_REFLECT)
+
+
+def blur_pair(width, height, seed=0):
+    """A sharp, high-frequency scene and the same scene with a Gaussian (motion-like) blur."""
+    rng = np.random.default_rng(seed)
+    sharp = (_texture(rng, height, width, 8) * 255).astype(np.uint8)
+    for _ in range(40):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        cv2.putText(sharp, "ABC", (x, y), cv2.FONT_HERSHEY_SIMPLEX, width / 800, (0, 0, 0), max(1, width // 800))
+    blurred = cv2.GaussianBlur(sharp, (0, 0), max(1.0, width / 600))
+    return sharp, blurred
+
+
+def faces(width, height, count=3, seed=0, eyes_open=True):
+    """Simple drawn faces (skin ellipse, eyes, mouth) on a textured background."""
+    rng = np.random.default_rng(seed)
+    image = (_texture(rng, height, width, 32) * 120 + 60).astype(np.uint8)
+    face_w = width // (count * 2 + 1)
+    for i in range(count):
+        cx = face_w * (2 * i + 1) + face_w // 2
+        cy = height // 2 + int(rng.integers(-height // 10, height // 10))
+        axes = (face_w // 2, int(face_w * 0.65))
+        cv2.ellipse(image, (cx, cy), axes, 0, 0, 360, (150, 180, 225), -1)
+        eye_y = cy - axes[1] // 4
+        for ex in (cx - axes[0] // 2, cx + axes[0] // 2):
+            cv2.ellipse(image, (ex, eye_y), (axes[0] // 5, axes[1] // 10), 0, 0, 360, (255, 255, 255), -1)
+            if eyes_open:
+                cv2.circle(image, (ex, eye_y), axes[1] // 14, (40, 30, 20), -1)
+            else:
+                cv2.line(image, (ex - axes[0] // 5, eye_y), (ex + axes[0] // 5, eye_y), (40, 30, 20),
+                         max(1, face_w // 60))
+        cv2.ellipse(image, (cx, cy + axes[1] // 2), (axes[0] // 3, axes[1] // 10), 0, 0, 180,
+                    (60, 60, 150), max(1, face_w // 40))
+    return image
+
+
+def generate_dataset(out_dir, megapixels=(1, 12), seed=0, quality=92):
+    """Writes one photo of each kind per size to `out_dir` and returns {name: path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for mp in megapixels:
+        w, h = SIZES[mp]
+        sharp, blurred = blur_pair(w, h, seed)
+        images = {
+            f"horizon_{mp}mp": horizon(w, h, 3.0, seed),
+            f"sharp_{mp}mp": sharp,
+            f"blurred_{mp}mp": blurred,
+            f"faces_{mp}mp": faces(w, h, 3, seed),
+            f"faces_closed_{mp}mp": faces(w, h, 3, seed, eyes_open=False),
+        }
+        for name, image in images.items():
+            path = os.path.join(out_dir, name + ".jpg")
+            cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            written[name] = path
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1, 12], choices=sorted(SIZES), help="megapixels")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    written = generate_dataset(args.out_dir, args.sizes, args.seed)
+    print(json.dumps(written, indent=2))
+
+
+if __name__ == "__main__":
+    main()
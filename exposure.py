@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from frame import Frame
+from image_cache import downscale
+from models import get_model_registry
+from thumbnails import load_thumbnail
+
+
+# Histograms are taken on proxies with this long side; 512px keeps every tone level populated.
+HISTOGRAM_SIDE = 512
+CLIP_LIMIT = 2.0
+GRID = (8, 8)
+
+
+# Matching works on the luma plane of YCrCb: the round trip costs a fraction of a LAB one and
+# the chroma planes pass through untouched.
+def luma(image, channel_order="BGR"):
+    code = cv2.COLOR_BGR2YCrCb if channel_order == "BGR" else cv2.COLOR_RGB2YCrCb
+    return cv2.cvtColor(image, code)[:, :, 0]
+
+
+def local_contrast(y, clip_limit=CLIP_LIMIT, grid=GRID):
+    """CLAHE of a luma plane with a pooled CLAHE instance; None skips it."""
+    if clip_limit is None:
+        return y
+    with get_model_registry().clahe(clip_limit, grid) as clahe:
+        return clahe.apply(y)
+
+
+def luma_histogram(image, channel_order="BGR", clip_limit=CLIP_LIMIT, grid=GRID):
+    """Normalized 256-bin histogram of luma after local contrast, taken on a HISTOGRAM_SIDE proxy."""
+    y = local_contrast(luma(downscale(image, HISTOGRAM_SIDE), channel_order), clip_limit, grid)
+    hist = cv2.calcHist([y], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+    return hist / max(hist.sum(), 1.0)
+
+
+def shared_target(histograms):
+    """Target CDF for a set of images: the CDF of their average histogram."""
+    cdf = np.cumsum(np.mean(histograms, axis=0))
+    return cdf / cdf[-1]
+
+
+def matching_lut(histogram, target_cdf, strength=1.0):
+    """Lookup table that maps an image with `histogram` onto `target_cdf` (histogram matching).
+
+    `strength` blends between the identity (0) and the full match (1).
+    """
+    cdf = np.cumsum(histogram)
+    cdf /= max(cdf[-1], 1e-12)
+    matched = np.searchsorted(np.asarray(target_cdf), cdf - 1e-9).clip(0, 255)
+    levels = np.arange(256)
+    return np.clip(np.rint(levels + strength * (matched - levels)), 0, 255).astype(np.uint8)
+
+
+def match_exposure(image, target_cdf, histogram=None, clip_limit=CLIP_LIMIT, grid=GRID, strength=1.0):
+    """Applies local contrast and then the LUT that matches `target_cdf` to a BGR image."""
+    if histogram is None:
+        histogram = luma_histogram(image, clip_limit=clip_limit, grid=grid)
+    lut = matching_lut(histogram, target_cdf, strength)
+    ycrcb = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
+    ycrcb[:, :, 0] = cv2.LUT(local_contrast(np.ascontiguousarray(ycrcb[:, :, 0]), clip_limit, grid), lut)
+    return cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+
+
+def _proxy_histogram(image_path, clip_limit, grid):
+    # Draft decoding reads JPEGs at 1/2 to 1/8 scale, so no full frame is decoded here.
+    frame = Frame.from_pil(load_thumbnail(image_path, HISTOGRAM_SIDE))
+    return luma_histogram(frame.array, frame.channel_order, clip_limit, grid)
+
+
+def exposure_target(image_paths, clip_limit=CLIP_LIMIT, grid=GRID, max_workers=None):
+    """Gathers proxy histograms of all images in one threaded pass and returns their shared target CDF."""
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1)) as pool:
+        histograms = list(pool.map(lambda path: _proxy_histogram(path, clip_limit, grid), image_paths))
+    return shared_target(histograms)
@@ -0,0 +1,72 @@
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from image_cache import downscale
+from models import EYE_CASCADE, FACE_CASCADE, get_model_registry
+
+
+FACE_PROXY_SIDE = 1024
+EYE_ROI_WIDTH = 160
+
+# faces: (N, 4) int array of x, y, w, h boxes in full-resolution pixels
+# eyes: list with one (M, 4) array of eye boxes per face, also in full-resolution pixels
+# overlap: (N, N) pairwise IoU matrix with a zero diagonal
+FaceAnalysis = namedtuple("FaceAnalysis", "faces eyes overlap")
+
+
+def eyes_open_ratio(analysis):
+    """Fraction of detected faces in which at least one eye was found."""
+    if len(analysis.faces) == 0:
+        return 0.0
+    return sum(len(eyes) > 0 for eyes in analysis.eyes) / len(analysis.faces)
+
+
+def max_overlap(analysis):
+    return float(analysis.overlap.max()) if analysis.overlap.size else 0.0
+
+
+def pairwise_iou(boxes):
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    inter_w = np.clip(np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1), 0, None)
+    inter_h = np.clip(np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1), 0, None)
+    inter = inter_w * inter_h
+    area = boxes[:, 2] * boxes[:, 3]
+    union = area[:, None] + area - inter
+    iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+    np.fill_diagonal(iou, 0)
+    return iou
+
+
+def detect_eyes(gray, face, eye_cascade):
+    # Eyes sit in the upper half of a face box; searching only there is far cheaper than the
+    # whole frame and avoids matches on buttons, wheels and other round shapes.
+    x, y, w, h = face
+    roi = gray[y:y + h // 2, x:x + w]
+    scale = min(1.0, EYE_ROI_WIDTH / max(1, w))
+    if scale < 1.0:
+        roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    min_side = max(4, int(roi.shape[1] * 0.12))
+    eyes = eye_cascade.detectMultiScale(roi, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side))
+    eyes = np.asarray(eyes, dtype=np.float64).reshape(-1, 4) / scale
+    eyes[:, 0] += x
+    eyes[:, 1] += y
+    return eyes.round().astype(int)
+
+
+def analyze_faces(gray, face_cascade_name=FACE_CASCADE, eye_cascade_name=EYE_CASCADE,
+                  proxy_side=FACE_PROXY_SIDE, gray_at=None):
+    """Detects faces once on a downscaled frame and eyes inside each face; returns a FaceAnalysis."""
+    registry = get_model_registry()
+    proxy = gray_at(proxy_side) if gray_at else downscale(gray, proxy_side)
+    scale = gray.shape[1] / proxy.shape[1]
+    min_side = max(20, proxy_side // 40)
+    with registry.cascade(face_cascade_name) as face_cascade:
+        faces = face_cascade.detectMultiScale(proxy, scaleFactor=1.1, minNeighbors=5, minSize=(min_side, min_side))
+    faces = (np.asarray(faces, dtype=np.float64).reshape(-1, 4) * scale).round().astype(int)
+    with registry.cascade(eye_cascade_name) as eye_cascade:
+        eyes = [detect_eyes(gray, face, eye_cascade) for face in faces]
+    return FaceAnalysis(faces, eyes, pairwise_iou(faces))
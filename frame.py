@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+from PIL import Image
+
+from instrumentation import stage
+
+
+# (stored order, wanted order) -> cv2 conversion code
+CONVERSIONS = {
+    ("BGR", "RGB"): cv2.COLOR_BGR2RGB,
+    ("RGB", "BGR"): cv2.COLOR_RGB2BGR,
+    ("BGR", "L"): cv2.COLOR_BGR2GRAY,
+    ("RGB", "L"): cv2.COLOR_RGB2GRAY,
+}
+
+
+class Frame:
+    """A decoded uint8 image: one contiguous array plus the order of its channels.
+
+    OpenCV code works on BGR, PIL and Qt expect RGB. A Frame hands each of them a view of its
+    buffer and only converts the channel order when a consumer needs the other one, once.
+    """
+
+    def __init__(self, array, channel_order="BGR"):
+        if array.ndim == 2:
+            channel_order = "L"
+        elif channel_order not in ("BGR", "RGB") or array.shape[2] != 3:
+            raise ValueError(f"Unsupported frame: {array.shape} {channel_order}")
+        self.array = np.ascontiguousarray(array, dtype=np.uint8)
+        self.channel_order = channel_order
+        self._views = {channel_order: self.array}
+
+    @classmethod
+    def from_pil(cls, image):
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        return cls(np.asarray(image), image.mode)
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    def as_order(self, channel_order):
+        """Returns the pixels in `channel_order`, converting only if it differs from the stored order."""
+        if self.channel_order == "L":
+            return self.array
+        view = self._views.get(channel_order)
+        if view is None:
+            with stage(f"convert:{self.channel_order}->{channel_order}", self.array.nbytes):
+                view = cv2.cvtColor(self.array, CONVERSIONS[self.channel_order, channel_order])
+            self._views[channel_order] = view
+        return view
+
+    def bgr(self):
+        return self.as_order("BGR")
+
+    def rgb(self):
+        return self.as_order("RGB")
+
+    def to_pil(self):
+        """Returns a PIL image sharing the frame's RGB (or gray) buffer."""
+        mode = "L" if self.channel_order == "L" else "RGB"
+        array = self.as_order(mode)
+        return Image.frombuffer(mode, (self.width, self.height), array, "raw", mode, 0, 1)
+
+    def to_qimage(self):
+        """Returns a QImage over the frame's buffer; it is only valid while the frame is alive."""
+        from PyQt5.QtGui import QImage
+
+        if self.channel_order == "L":
+            array, image_format = self.array, QImage.Format_Grayscale8
+        elif self.channel_order == "BGR" and hasattr(QImage, "Format_BGR888"):  # Qt 5.14+
+            array, image_format = self.array, QImage.Format_BGR888
+        else:
+            array, image_format = self.rgb(), QImage.Format_RGB888
+        return QImage(array.data, self.width, self.height, array.strides[0], image_format)
+
+    def save(self, output_path, **params):
+        """Encodes through PIL, which picks the format from the file extension."""
+        self.to_pil().save(output_path, **params)
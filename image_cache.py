@@ -0,0 +1,148 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from instrumentation import stage
+
+
+DEFAULT_BUDGET_BYTES = 1024 * 1024 * 1024
+
+
+class CacheEntry:
+    def __init__(self, key, image):
+        self.key = key
+        self.image = image
+        self.derived = {}
+        self.lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        total = self.image.nbytes
+        # Other threads may add views meanwhile; list() copies the values in one step under the GIL.
+        for value in list(self.derived.values()):
+            total += getattr(value, "nbytes", 0)
+        return total
+
+
+class ImageCache:
+    """Process-wide LRU cache of decoded images and views derived from them."""
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_path):
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def entry(self, image_path):
+        key = self.make_key(image_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        image = decode(key[0])
+        # Cached arrays are shared between callers, so nobody may modify them in place.
+        image.flags.writeable = False
+        entry = CacheEntry(key, image)
+        with self._lock:
+            self.misses += 1
+            self._drop_stale(key[0])
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def get(self, image_path):
+        return self.entry(image_path).image
+
+    def derive(self, image_path, name, factory):
+        """Returns the view `name` of the image, building it with `factory(image)` on first use."""
+        entry = self.entry(image_path)
+        with entry.lock:
+            value = entry.derived.get(name)
+            if value is None:
+                # Parameterized views ("proxy:1024") share one stage so the summary stays readable.
+                with stage("derive:" + name.split(":")[0]) as record:
+                    value = factory(entry.image)
+                    record.nbytes = getattr(value, "nbytes", 0)
+                entry.derived[name] = value
+        with self._lock:
+            self._evict()
+        return value
+
+    def gray(self, image_path):
+        return self.derive(image_path, "gray", lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+
+    def edges(self, image_path, low=50, high=150):
+        gray = self.gray(image_path)
+        return self.derive(image_path, f"edges:{low}:{high}",
+                           lambda _: cv2.Canny(gray, low, high, apertureSize=3))
+
+    def proxy(self, image_path, max_side):
+        return self.derive(image_path, f"proxy:{max_side}",
+                           lambda image: downscale(image, max_side))
+
+    def gray_proxy(self, image_path, max_side):
+        return self.derive(image_path, f"gray_proxy:{max_side}",
+                           lambda _: downscale(self.gray(image_path), max_side))
+
+    def invalidate(self, image_path=None):
+        with self._lock:
+            if image_path is None:
+                self._entries.clear()
+            else:
+                self._drop_stale(os.path.abspath(image_path), keep=None)
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop_stale(self, path, keep=None):
+        for key in [k for k in self._entries if k[0] == path and k != keep]:
+            del self._entries[key]
+
+    def _evict(self):
+        total = sum(entry.nbytes for entry in self._entries.values())
+        # Always keep the most recently used entry, even if it alone exceeds the budget.
+        while total > self.budget_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry.nbytes
+
+
+def decode(image_path):
+    """Reads an image as a BGR array without caching it."""
+    with stage("decode") as record:
+        image = cv2.imread(image_path)
+        if image is None:
+            raise IOError(f"Could not decode image: {image_path}")
+        record.nbytes = image.nbytes
+    return image
+
+
+def downscale(image, max_side):
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return image
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+_cache = ImageCache()
+
+
+def get_image_cache():
+    return _cache
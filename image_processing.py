@@ -2,24 +2,95 @@ import cv2
 import numpy as np
 from PIL import Image
 
+from image_cache import downscale, get_image_cache
+from instrumentation import stage
+from metrics_store import get_metrics_store
+from exposure import HISTOGRAM_SIDE, luma_histogram, match_exposure
+from face_analysis import analyze_faces, eyes_open_ratio, max_overlap
+from models import EYE_CASCADE, FACE_CASCADE, get_model_registry
+from sharpness import SHARPNESS_SIDE, focus_map, sharpness, subject_sharpness
+from selection import SelectionEngine
+from skew import estimate_skew
+from smart_crop import SALIENCY_SIDE, best_window, importance_map, summed_area_table
+from tiling import DEFAULT_MEMORY_BUDGET, clahe, laplacian_variance, upscale_tiled
+
 
 class ImageProcessing:
+    # "fast" or "accurate", see skew.SKEW_MODES
+    skew_mode = "fast"
+    # Skew estimates below this confidence leave the photo unrotated.
+    skew_min_confidence = 0.3
+    # Keep scalar scores in processed/metrics.sqlite so reopening a folder doesn't recompute them.
+    use_metrics_store = True
+    # Bytes of working memory for tiled processing of large images; None processes the full frame.
+    memory_budget = None
+
     def __init__(self, image_path):
         self.image_path = image_path
-        self.image = cv2.imread(image_path)
+        self.cache = get_image_cache()
+        self._image = None
+        self._derived = {}
+
+    @classmethod
+    def from_array(cls, image):
+        """Wraps an already decoded BGR array, e.g. an intermediate result of a correction chain."""
+        processor = cls.__new__(cls)
+        processor.image_path = None
+        processor.cache = None
+        processor._image = image
+        processor._derived = {}
+        return processor
+
+    @property
+    def image(self):
+        # Decoded on first use, so scores answered by the metrics store never touch the pixels.
+        if self._image is None:
+            self._image = self.cache.get(self.image_path)
+        return self._image
+
+    @property
+    def resolution(self):
+        if self._image is None and self.image_path is not None:
+            return int(self.metric("resolution", self._header_resolution))
+        return self.image.shape[0] * self.image.shape[1]
+
+    def _header_resolution(self):
+        with Image.open(self.image_path) as image:
+            return image.size[0] * image.size[1]
+
+    def metric(self, name, compute):
+        """Returns the scalar score `name`, from the metrics store when this file was scored before."""
+        store = get_metrics_store(self.image_path) if self.image_path and self.use_metrics_store else None
+        if store is None:
+            return compute()
+        return store.metric(self.image_path, name, compute)
+
+    def derive(self, name, factory):
+        if self.image_path is not None:
+            return self.cache.derive(self.image_path, name, factory)
+        if name not in self._derived:
+            with stage("derive:" + name.split(":")[0]):
+                self._derived[name] = factory(self.image)
+        return self._derived[name]
+
+    @property
+    def gray(self):
+        return self.derive("gray", lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+
+    def gray_proxy(self, max_side):
+        return self.derive(f"gray_proxy:{max_side}", lambda _: downscale(self.gray, max_side))
+
+    def edges(self, low=50, high=150):
+        return self.derive(f"edges:{low}:{high}", lambda _: cv2.Canny(self.gray, low, high, apertureSize=3))
 
     def horizontal_correction_no_crop(self):
-        angle = self.detect_skew_angle()
+        angle = self.correction_angle()
         if angle:
-            h, w = self.image.shape[:2]
-            rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1)
-            rotated = cv2.warpAffine(self.image, rotation_matrix, (w, h))
-            rotated = self.add_padding(rotated, angle)
-            return rotated
+            return self.rotate_bound(self.image, angle)
         return self.image
 
     def horizontal_correction_crop(self):
-        angle = self.detect_skew_angle()
+        angle = self.correction_angle()
         if angle:
             h, w = self.image.shape[:2]
             rotation_matrix = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1)
@@ -27,17 +98,37 @@ class ImageProcessing:
             return self.crop_to_rectangle(rotated, angle)
         return self.image
 
-    def detect_skew_angle(self):
-        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-        lines = cv2.HoughLines(edges, 1, np.pi / 180, 200)
-        angles = []
-        if lines is not None:
-            for rho, theta in lines[:, 0]:
-                angle = np.degrees(theta) - 90
-                angles.append(angle)
-            return np.median(angles)
-        return 0
+    def detect_skew(self, mode=None):
+        """Returns (angle, confidence) from the multi-resolution estimator in skew.py."""
+        mode = mode or self.skew_mode
+
+        def estimate():
+            return self.derive(f"skew:{mode}", lambda _: estimate_skew(self.gray, mode, gray_at=self.gray_proxy))
+        # v2: angles at the edge of the search range are rejected, so older stored values are not reused.
+        return (self.metric(f"skew:{mode}:v2", lambda: estimate()[0]),
+                self.metric(f"skew_confidence:{mode}:v2", lambda: estimate()[1]))
+
+    def detect_skew_angle(self, mode=None):
+        return self.detect_skew(mode)[0]
+
+    def correction_angle(self, mode=None):
+        """The skew angle to rotate by, or 0 when the estimate is not confident enough."""
+        angle, confidence = self.detect_skew(mode)
+        return angle if confidence >= self.skew_min_confidence else 0.0
+
+    @staticmethod
+    def rotate_bound(image, angle, border_value=(0, 0, 0)):
+        # Rotate straight into the exact bounding box of the rotated frame with a single warp,
+        # instead of padding by the diagonal on every side and warping twice.
+        h, w = image.shape[:2]
+        rotation_matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1)
+        cos, sin = abs(rotation_matrix[0, 0]), abs(rotation_matrix[0, 1])
+        new_w = int(np.ceil(h * sin + w * cos))
+        new_h = int(np.ceil(h * cos + w * sin))
+        rotation_matrix[0, 2] += new_w / 2 - w / 2
+        rotation_matrix[1, 2] += new_h / 2 - h / 2
+        return cv2.warpAffine(image, rotation_matrix, (new_w, new_h),
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=border_value)
 
     def add_padding(self, image, angle):
         h, w = image.shape[:2]
@@ -56,67 +147,148 @@ class ImageProcessing:
         return image[y:y + h, x:x + w]
 
     def crop_with_aspect_ratio(self, aspect_ratio):
+        """Largest crop with the given ratio, placed to keep faces and salient content."""
+        x, y, w, h = self.crop_window(aspect_ratio)
+        return self.image[y:y + h, x:x + w]
+
+    def crop_with_aspect_ratios(self, aspect_ratios):
+        """Returns {ratio: crop}; the importance map is shared, so extra ratios are nearly free."""
+        return {ratio: self.crop_with_aspect_ratio(ratio) for ratio in aspect_ratios}
+
+    def crop_window(self, aspect_ratio):
         h, w = self.image.shape[:2]
-        new_w = int(aspect_ratio * h) if aspect_ratio > 1 else w
-        new_h = int(w / aspect_ratio) if aspect_ratio < 1 else h
-        x = (w - new_w) // 2
-        y = (h - new_h) // 2
-        cropped = self.image[y:y + new_h, x:x + new_w]
-        return cropped
-
-    def evaluate_blur(self):
-        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-        variance = cv2.Laplacian(gray, cv2.CV_64F).var()
-        return variance
+        return best_window(self.importance_table(), (w, h), aspect_ratio)
+
+    def importance_map(self):
+        """Saliency plus detected faces on a SALIENCY_SIDE proxy; see smart_crop.importance_map."""
+        def build(image):
+            proxy = self.gray_proxy(SALIENCY_SIDE)
+            return importance_map(proxy, self.analyze_faces().faces, proxy.shape[1] / image.shape[1])
+        return self.derive(f"importance:{SALIENCY_SIDE}", build)
+
+    def importance_table(self):
+        return self.derive(f"importance_sat:{SALIENCY_SIDE}", lambda _: summed_area_table(self.importance_map()))
+
+    def unify_exposure(self):
+        if self.memory_budget:
+            return self._unify_exposure_tiled()
+        lab = cv2.cvtColor(self.image, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        with get_model_registry().clahe(3.0, (8, 8)) as equalizer:
+            cl = equalizer.apply(l)
+        merged = cv2.merge((cl, a, b))
+        return cv2.cvtColor(merged, cv2.COLOR_LAB2BGR)
+
+    def match_exposure(self, target_cdf, strength=1.0):
+        """Matches the luma distribution to a target shared by a set of images (see exposure.py)."""
+        histogram = self.derive(f"luma_hist:{HISTOGRAM_SIDE}", luma_histogram)
+        return match_exposure(self.image, target_cdf, histogram, strength=strength)
+
+    def _unify_exposure_tiled(self):
+        # Color conversion is per pixel, so it can run strip by strip; only the L plane and
+        # the output are full size.
+        h, w = self.image.shape[:2]
+        rows = max(1, self.memory_budget // (w * 3 * 4))
+        l = np.empty((h, w), dtype=np.uint8)
+        for y in range(0, h, rows):
+            l[y:y + rows] = cv2.cvtColor(self.image[y:y + rows], cv2.COLOR_BGR2LAB)[:, :, 0]
+        l = clahe(l, clip_limit=3.0, grid=(8, 8), budget=self.memory_budget)
+        result = np.empty_like(self.image)
+        for y in range(0, h, rows):
+            lab = cv2.cvtColor(self.image[y:y + rows], cv2.COLOR_BGR2LAB)
+            lab[:, :, 0] = l[y:y + rows]
+            result[y:y + rows] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        return result
+
+    def evaluate_blur(self, full_resolution=False):
+        """Laplacian variance on a SHARPNESS_SIDE proxy, so scores compare across resolutions."""
+        if full_resolution:
+            return self.metric("blur:full", lambda: laplacian_variance(
+                self.gray, self.memory_budget or DEFAULT_MEMORY_BUDGET))
+        return self.metric(f"blur:{SHARPNESS_SIDE}", lambda: sharpness(self.gray_proxy(SHARPNESS_SIDE)))
+
+    def focus_map(self):
+        """Per-cell sharpness on the proxy, telling a sharp subject on bokeh apart from a blurred shot."""
+        return self.derive("focus_map", lambda _: focus_map(self.gray_proxy(SHARPNESS_SIDE)))
+
+    def evaluate_subject_blur(self):
+        return self.metric(f"subject_blur:{SHARPNESS_SIDE}", lambda: subject_sharpness(self.focus_map()))
+
+    def exposure_quality(self):
+        """1 for a mid-gray mean with no clipping, falling towards 0 for dark, bright or clipped frames."""
+        def compute():
+            hist = cv2.calcHist([self.gray_proxy(SHARPNESS_SIDE)], [0], None, [256], [0, 256]).ravel()
+            hist /= max(hist.sum(), 1.0)
+            mean = float(np.dot(hist, np.arange(256))) / 255
+            clipped = float(hist[:5].sum() + hist[251:].sum())
+            return max(0.0, 1.0 - 2 * abs(mean - 0.5) - clipped)
+        return self.metric(f"exposure_quality:{SHARPNESS_SIDE}", compute)
+
+    def selection_features(self):
+        """One selection.FEATURES row; every value comes from the metrics store when available."""
+        return (self.evaluate_blur(), self.exposure_quality(), self.eyes_open_ratio(),
+                float(self.filter_closed_eyes()), self.detect_face_overlap(), float(self.resolution))
+
+    @staticmethod
+    def selection_engine(weights=None):
+        return SelectionEngine(lambda image_path: ImageProcessing(image_path).selection_features(), weights)
 
     @staticmethod
     def find_least_blurry(images):
         scores = [(img, ImageProcessing(img).evaluate_blur()) for img in images]
         return max(scores, key=lambda x: x[1])[0]
 
-    def filter_closed_eyes(self, eye_classifier_path="haarcascade_eye.xml"):
-        eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + eye_classifier_path)
-        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-        eyes = eye_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-        return len(eyes) > 0
+    def analyze_faces(self, face_classifier_path=FACE_CASCADE, eye_classifier_path=EYE_CASCADE):
+        """Runs the shared face/eye pass once per image; see face_analysis.FaceAnalysis."""
+        return self.derive(f"faces:{face_classifier_path}:{eye_classifier_path}",
+                           lambda _: analyze_faces(self.gray, face_classifier_path, eye_classifier_path,
+                                                   gray_at=self.gray_proxy))
+
+    def filter_closed_eyes(self, eye_classifier_path=EYE_CASCADE):
+        # Only faces are searched for eyes; without a face there are no closed eyes, so the photo passes.
+        return bool(self.metric(f"eyes_found:faces:{eye_classifier_path}", lambda: self._find_eyes(eye_classifier_path)))
+
+    def _find_eyes(self, eye_classifier_path):
+        analysis = self.analyze_faces(eye_classifier_path=eye_classifier_path)
+        return not len(analysis.faces) or eyes_open_ratio(analysis) > 0
+
+    def eyes_open_ratio(self):
+        return self.metric("eyes_open_ratio", lambda: eyes_open_ratio(self.analyze_faces()))
 
     @staticmethod
-    def remove_closed_eyes(images):
-        results = []
-        for img_path in images:
-            processor = ImageProcessing(img_path)
-            if processor.filter_closed_eyes():
-                results.append(img_path)
-        return results if results else [ImageProcessing.find_least_blurry(images)]
-
-    def detect_face_overlap(self, face_classifier_path="haarcascade_frontalface_default.xml"):
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + face_classifier_path)
-        gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
-        overlap_score = 0
-        for (x, y, w, h) in faces:
-            overlap_score += w * h 
-        return overlap_score
+    def remove_closed_eyes(images, engine=None):
+        engine = engine or ImageProcessing.selection_engine()
+        features = engine.features_for(images)
+        results = [img for img, found in zip(images, features["eyes_found"]) if found]
+        return results if results else [images[int(np.argmax(features["sharpness"]))]]
+
+    def detect_face_overlap(self, face_classifier_path=FACE_CASCADE):
+        # Largest intersection-over-union between any two faces: 0 when nobody overlaps.
+        return self.metric(f"face_overlap:{face_classifier_path}",
+                           lambda: max_overlap(self.analyze_faces(face_classifier_path=face_classifier_path)))
 
     @staticmethod
-    def remove_face_overlap(images):
-        scores = [(img, ImageProcessing(img).detect_face_overlap()) for img in images]
-        scores.sort(key=lambda x: x[1]) 
-        return [img for img, score in scores if score == scores[0][1]]
+    def remove_face_overlap(images, engine=None):
+        engine = engine or ImageProcessing.selection_engine()
+        overlap = engine.features_for(images)["overlap"]
+        return [img for img, score in zip(images, overlap) if score == overlap.min()]
 
     @staticmethod
-    def find_best_quality(images):
-        scores = []
-        for img in images:
-            processor = ImageProcessing(img)
-            blur_score = processor.evaluate_blur()
-            resolution = processor.image.shape[0] * processor.image.shape[1]
-            scores.append((img, blur_score + resolution))
-        return max(scores, key=lambda x: x[1])[0]
+    def find_best_quality(images, weights=None, engine=None):
+        """Best image by the weighted selection score (see selection.DEFAULT_WEIGHTS)."""
+        engine = engine or ImageProcessing.selection_engine()
+        return engine.best(images, weights)
 
-    def enhance_resolution(self):
-        sr = cv2.dnn_superres.DnnSuperResImpl_create()
-        sr.readModel("EDSR_x4.pb") 
-        sr.setModel("edsr", 4) 
-        result = sr.upsample(self.image)
+    def enhance_resolution(self, out=None):
+        """Upscales 4x with EDSR. In tiled mode tiles go into `out`, or a file-backed tiling.disk_array."""
+        with get_model_registry().superres("EDSR_x4.pb", "edsr", 4) as sr:
+            if self.memory_budget:
+                return upscale_tiled(self.image, sr.upsample, 4, self.memory_budget, out=out)
+            result = sr.upsample(self.image)
         return result
+
+
+if __name__ == "__main__":
+    import sys
+    from pipeline import main
+    sys.exit(main())
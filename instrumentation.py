@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+
+MAX_EVENTS = 100000
+
+# start is seconds since the epoch; duration in seconds; nbytes is what the stage read or wrote.
+StageEvent = namedtuple("StageEvent", "name start duration nbytes pid tid")
+
+
+class StageRecord:
+    """Handed out by stage() so the body can report the bytes it processed once it knows them."""
+
+    def __init__(self, nbytes=0):
+        self.nbytes = nbytes
+
+
+class StageRegistry:
+    """In-process record of how long each processing stage took and how many bytes it handled."""
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = True
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def record(self, name, start, duration, nbytes=0):
+        event = StageEvent(name, start, duration, int(nbytes), os.getpid(), threading.get_ident())
+        with self._lock:
+            self._events.append(event)
+
+    def extend(self, events):
+        """Adds events recorded elsewhere, e.g. returned by a pool worker."""
+        with self._lock:
+            self._events.extend(StageEvent(*event) for event in events)
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def drain(self):
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def summary(self):
+        """Returns {stage: {"count", "total", "min", "max", "bytes"}} sorted by total time."""
+        stats = {}
+        for event in self.events():
+            entry = stats.setdefault(event.name, {"count": 0, "total": 0.0, "min": float("inf"),
+                                                   "max": 0.0, "bytes": 0})
+            entry["count"] += 1
+            entry["total"] += event.duration
+            entry["min"] = min(entry["min"], event.duration)
+            entry["max"] = max(entry["max"], event.duration)
+            entry["bytes"] += event.nbytes
+        return dict(sorted(stats.items(), key=lambda item: item[1]["total"], reverse=True))
+
+    def summary_table(self):
+        summary = self.summary()
+        width = max([len(name) for name in summary] + [24])
+        lines = [f"{'stage':<{width}} {'calls':>7} {'total ms':>11} {'mean ms':>9} {'max ms':>9} {'MB':>9}"]
+        for name, entry in summary.items():
+            lines.append(f"{name:<{width}} {entry['count']:>7} {entry['total'] * 1000:>11.1f} "
+                         f"{entry['total'] / entry['count'] * 1000:>9.2f} {entry['max'] * 1000:>9.2f} "
+                         f"{entry['bytes'] / 2**20:>9.1f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """Returns the events in Chrome trace format (load the JSON in chrome://tracing or Perfetto)."""
+        return {"traceEvents": [
+            {"name": event.name, "ph": "X", "ts": event.start * 1e6, "dur": event.duration * 1e6,
+             "pid": event.pid, "tid": event.tid, "args": {"bytes": event.nbytes}}
+            for event in self.events()
+        ], "displayTimeUnit": "ms"}
+
+    def prometheus_text(self, prefix="image_processing"):
+        summary = self.summary()
+        lines = []
+        for metric, kind, key, help_text in (
+                ("stage_calls_total", "counter", "count", "Number of times the stage ran."),
+                ("stage_seconds_total", "counter", "total", "Time spent in the stage."),
+                ("stage_seconds_max", "gauge", "max", "Longest single run of the stage."),
+                ("stage_bytes_total", "counter", "bytes", "Bytes read or written by the stage.")):
+            lines.append(f"# HELP {prefix}_{metric} {help_text}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for name, entry in summary.items():
+                label = name.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'{prefix}_{metric}{{stage="{label}"}} {entry[key]}')
+        return "\n".join(lines) + "\n"
+
+
+_registry = StageRegistry()
+
+
+def get_stage_registry():
+    return _registry
+
+
+@contextmanager
+def stage(name, nbytes=0):
+    """Times the body as stage `name`; set `.nbytes` on the yielded record to report its size."""
+    record = StageRecord(nbytes)
+    if not _registry.enabled:
+        yield record
+        return
+    start = time.time()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _registry.record(name, start, time.perf_counter() - started, record.nbytes)
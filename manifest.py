@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics_store import content_hash
+
+
+MANIFEST_FILENAME = "manifest.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inputs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    input_path TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (input_path, params_hash)
+);
+"""
+
+
+def params_key(params):
+    """Stable (text, hash) form of a job's parameters."""
+    text = json.dumps(params, sort_keys=True, default=str)
+    return text, hashlib.sha1(text.encode()).hexdigest()
+
+
+@contextmanager
+def atomic_output(output_path):
+    """Yields a temporary path next to `output_path` that replaces it only if the body succeeds.
+
+    The temporary file keeps the extension, so encoders that pick the format from it still work.
+    """
+    directory, name = os.path.split(os.path.abspath(output_path))
+    # Only the name is reserved here: the encoder creates the file, so it gets the usual permissions.
+    tmp_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}{os.path.splitext(name)[1]}")
+    try:
+        yield tmp_path
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Manifest:
+    """Record of finished jobs in an output directory: input content + parameters -> outputs.
+
+    A job is current when its input still has the recorded content hash and every output it
+    wrote is still on disk unchanged, so rerunning a batch only redoes new or changed work.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def input_hash(self, image_path, store=True):
+        """Content hash of an input, rehashed only when its mtime or size changed.
+
+        With `store` False a new hash is computed but not saved.
+        """
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size, content_hash FROM inputs WHERE path = ?", (path,)).fetchone()
+        if row is not None and tuple(row[:2]) == (stat.st_mtime_ns, stat.st_size):
+            return row[2]
+        digest = content_hash(path)
+        if not store:
+            return digest
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO inputs (path, mtime_ns, size, content_hash) VALUES (?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, digest))
+        return digest
+
+    def stale_reason(self, image_path, params, input_hash=None):
+        """Returns why the job must run ("new", "input changed", ...), or None when it is current."""
+        path = os.path.abspath(image_path)
+        _, key = params_key(params)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT input_hash, outputs FROM jobs WHERE input_path = ? AND params_hash = ?",
+                (path, key)).fetchone()
+        if row is None:
+            return "new"
+        if row[0] != (input_hash or self.input_hash(path)):
+            return "input changed"
+        for output_path, mtime_ns, size, digest in json.loads(row[1]):
+            try:
+                stat = os.stat(output_path)
+            except OSError:
+                return "output missing"
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size) and content_hash(output_path) != digest:
+                return "output changed"
+        return None
+
+    def record(self, image_path, params, output_paths, input_hash=None):
+        path = os.path.abspath(image_path)
+        text, key = params_key(params)
+        outputs = []
+        for output_path in output_paths:
+            output_path = os.path.abspath(output_path)
+            stat = os.stat(output_path)
+            outputs.append((output_path, stat.st_mtime_ns, stat.st_size, content_hash(output_path)))
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jobs (input_path, params_hash, params, input_hash, outputs, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, key, text, input_hash or self.input_hash(path), json.dumps(outputs), time.time()))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(output_dir, create=True):
+    """Returns the shared manifest of `output_dir`; None if there is none yet and `create` is False."""
+    directory = os.path.abspath(output_dir)
+    db_path = os.path.join(directory, MANIFEST_FILENAME)
+    with _manifests_lock:
+        if directory not in _manifests:
+            if not create and not os.path.exists(db_path):
+                return None
+            os.makedirs(directory, exist_ok=True)
+            _manifests[directory] = Manifest(db_path)
+        return _manifests[directory]
+
+
+class JobPlan:
+    """Splits jobs (tuples whose first element is the input path) into pending and current ones.
+
+    `output_dir_for(job)` names the directory whose manifest covers the job and `params_for(job)`
+    returns everything besides the input that determines its output. With `create` False nothing
+    is written, which is what a dry run needs.
+    """
+
+    def __init__(self, jobs, output_dir_for, params_for, force=False, create=True):
+        self.pending = []
+        self.current = []
+        self.reasons = {}
+        self._records = {}
+        for job in jobs:
+            manifest = get_manifest(output_dir_for(job), create)
+            params = params_for(job)
+            if manifest is None:
+                reason, input_hash = "new", None
+            else:
+                input_hash = manifest.input_hash(job[0], store=create)
+                reason = "forced" if force else manifest.stale_reason(job[0], params, input_hash)
+            if reason is None:
+                self.current.append(job)
+                continue
+            self.pending.append(job)
+            self.reasons[job[0]] = reason
+            self._records[os.path.abspath(job[0])] = (manifest, params, input_hash)
+
+    def record(self, result):
+        """Stores a finished JobResult; failed jobs stay pending for the next run."""
+        if result.error or not result.output_path:
+            return
+        manifest, params, input_hash = self._records[os.path.abspath(result.image_path)]
+        if manifest is None:
+            return
+        outputs = result.output_path if isinstance(result.output_path, list) else [result.output_path]
+        manifest.record(result.image_path, params, outputs, input_hash)
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+METRICS_FILENAME = "metrics.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (path, name)
+);
+"""
+
+
+def content_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MetricsStore:
+    """SQLite cache of per-image scores (blur, skew, faces, ...) that survives between sessions.
+
+    Rows are validated against the file's mtime and size; when those change, the content hash
+    decides whether the cached scores still apply, so touching or copying a file is cheap.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._validated = {}
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            # WAL lets pool workers read while another process writes.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(SCHEMA)
+
+    def _validate(self, image_path):
+        """Makes sure the files row matches the file on disk and returns its absolute path."""
+        path = os.path.abspath(image_path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if self._validated.get(path) == signature:
+            return path
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size, content_hash FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None or tuple(row[:2]) != signature:
+                digest = content_hash(path)
+                if row is not None and row[2] != digest:
+                    self._connection.execute("DELETE FROM metrics WHERE path = ?", (path,))
+                self._connection.execute(
+                    "INSERT INTO files (path, mtime_ns, size, content_hash) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns, size = excluded.size, "
+                    "content_hash = excluded.content_hash",
+                    (path, *signature, digest))
+        self._validated[path] = signature
+        return path
+
+    def get(self, image_path, name):
+        path = self._validate(image_path)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM metrics WHERE path = ? AND name = ?", (path, name)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, image_path, **metrics):
+        path = self._validate(image_path)
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metrics (path, name, value, updated) VALUES (?, ?, ?, ?)",
+                [(path, name, float(value), now) for name, value in metrics.items()])
+
+    def metric(self, image_path, name, compute):
+        """Returns the stored score `name`, computing and storing it with `compute()` when missing."""
+        value = self.get(image_path, name)
+        if value is None:
+            value = float(compute())
+            self.put(image_path, **{name: value})
+        return value
+
+    def all(self, image_path):
+        path = self._validate(image_path)
+        with self._lock:
+            rows = self._connection.execute("SELECT name, value FROM metrics WHERE path = ?", (path,)).fetchall()
+        return dict(rows)
+
+    def prune(self):
+        """Removes rows of files that no longer exist. Returns the number of files removed."""
+        with self._lock, self._connection:
+            paths = [row[0] for row in self._connection.execute("SELECT path FROM files")]
+            gone = [(path,) for path in paths if not os.path.exists(path)]
+            self._connection.executemany("DELETE FROM files WHERE path = ?", gone)
+        for (path,) in gone:
+            self._validated.pop(path, None)
+        return len(gone)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_metrics_store(image_path):
+    """Returns the shared store kept in processed/ next to `image_path`, or None if it can't be created."""
+    directory = os.path.join(os.path.dirname(os.path.abspath(image_path)), "processed")
+    with _stores_lock:
+        if directory not in _stores:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                _stores[directory] = store = MetricsStore(os.path.join(directory, METRICS_FILENAME))
+                # Scores of files deleted since the store was last opened are dropped once per process.
+                store.prune()
+            except (OSError, sqlite3.Error) as exc:
+                print(f"Metrics store unavailable in {directory}: {exc}")
+                _stores[directory] = None
+        return _stores[directory]
@@ -0,0 +1,104 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+
+from instrumentation import stage
+
+
+EYE_CASCADE = "haarcascade_eye.xml"
+FACE_CASCADE = "haarcascade_frontalface_default.xml"
+SUPERRES_MODEL = ("EDSR_x4.pb", "edsr", 4)
+
+
+def load_cascade(name):
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+    if cascade.empty():
+        raise IOError(f"Could not load cascade classifier: {name}")
+    return cascade
+
+
+def load_superres(model_path, algorithm, scale):
+    sr = cv2.dnn_superres.DnnSuperResImpl_create()
+    sr.readModel(model_path)
+    sr.setModel(algorithm, scale)
+    return sr
+
+
+class ModelRegistry:
+    """Loads each detector or model lazily and lends the loaded instances to whichever thread needs one.
+
+    OpenCV cascades and DNN models keep mutable state while running, so an instance is used by
+    one thread at a time: `borrow` hands out an idle instance, loads another only when all of
+    them are busy, and takes it back afterwards. A process thus loads a model as many times as
+    it runs it concurrently, however many threads come and go. Every process of a pool gets its
+    own registry.
+    """
+
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.load_times = {}
+
+    @contextmanager
+    def borrow(self, key, loader, *args):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            model = idle.pop() if idle else None
+        if model is None:
+            model = self._load(key, loader, *args)
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._idle[key].append(model)
+
+    def _load(self, key, loader, *args):
+        started = time.perf_counter()
+        with stage(f"model_load:{key}"):
+            model = loader(*args)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.load_times.setdefault(key, []).append(elapsed)
+        return model
+
+    def cascade(self, name):
+        return self.borrow(f"cascade:{name}", load_cascade, name)
+
+    def superres(self, model_path=SUPERRES_MODEL[0], algorithm=SUPERRES_MODEL[1], scale=SUPERRES_MODEL[2]):
+        return self.borrow(f"superres:{model_path}:{algorithm}:{scale}", load_superres, model_path, algorithm, scale)
+
+    def clahe(self, clip_limit=3.0, grid=(8, 8)):
+        # CLAHE objects are cheap but keep per-call buffers, so they are pooled like the models.
+        return self.borrow(f"clahe:{clip_limit}:{grid[0]}x{grid[1]}", cv2.createCLAHE, clip_limit, tuple(grid))
+
+    def preload(self, names=(EYE_CASCADE, FACE_CASCADE)):
+        """Loads the given cascades (file names) or super-resolution models ((path, algorithm, scale)) now.
+
+        Any thread of the process can use them afterwards.
+        """
+        for name in names:
+            with self.superres(*name) if isinstance(name, tuple) else self.cascade(name):
+                pass
+
+    def timings(self):
+        """Returns {model key: (loads, total seconds)} for every model loaded so far."""
+        with self._lock:
+            return {key: (len(times), sum(times)) for key, times in self.load_times.items()}
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry():
+    return _registry
+
+
+def preload_models(names=(EYE_CASCADE, FACE_CASCADE)):
+    # Used as a pool initializer: a missing model file must not break the pool, the jobs
+    # that need it will report the error themselves.
+    try:
+        _registry.preload(names)
+    except Exception as exc:
+        print(f"Could not preload models: {exc}")
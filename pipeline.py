@@ -0,0 +1,216 @@
+import argparse
+import glob
+import os
+import re
+import sys
+
+import cv2
+
+from adjustments import apply_adjustments
+from batch import (OUTPUT_FORMATS, BatchExecutor, StagedExecutor, add_run_options, output_dir_for,
+                   output_path_for, print_plan, print_report, report_progress, run_incremental)
+from image_cache import decode, get_image_cache
+from image_processing import ImageProcessing
+from instrumentation import stage
+from manifest import JobPlan, atomic_output
+from skew import SKEW_MODES
+from smart_crop import parse_ratio
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+def _adjust(name):
+    def make_step(factor):
+        factor = float(factor)
+
+        def step(image, options):
+            return apply_adjustments(image, **{name: factor})
+        return step
+    return make_step
+
+
+def _processor_step(method, *args, skew_mode=None):
+    if skew_mode and skew_mode not in SKEW_MODES:
+        raise ValueError(f"Unknown skew mode '{skew_mode}'. Available: {', '.join(SKEW_MODES)}")
+
+    def step(image, options):
+        processor = ImageProcessing.from_array(image)
+        if skew_mode:
+            processor.skew_mode = skew_mode
+        processor.memory_budget = options.get("memory_budget")
+        return getattr(processor, method)(*args)
+    return step
+
+
+# name -> factory(argument or None) -> step(image, options) -> image, all on BGR arrays
+STEPS = {
+    "skew-crop": lambda arg: _processor_step("horizontal_correction_crop", skew_mode=arg),
+    "skew-pad": lambda arg: _processor_step("horizontal_correction_no_crop", skew_mode=arg),
+    "unify-exposure": lambda arg: _processor_step("unify_exposure"),
+    "brightness": _adjust("brightness"),
+    "color": _adjust("color"),
+    "contrast": _adjust("contrast"),
+    "aspect": lambda arg: _processor_step("crop_with_aspect_ratio", parse_ratio(arg)),
+    "upscale": lambda arg: _processor_step("enhance_resolution"),
+}
+STEPS_WITH_ARGUMENT = {"brightness", "color", "contrast", "aspect"}
+
+
+class Pipeline:
+    """An ordered chain of corrections applied in memory to one decoded image.
+
+    Chains are written as `skew-crop -> unify-exposure -> brightness=1.1 -> aspect=16:9`.
+    The skew steps take an optional mode, e.g. `skew-crop=accurate`.
+    """
+
+    def __init__(self, chain, memory_budget=None):
+        self.chain = chain
+        self.options = {"memory_budget": memory_budget}
+        # Normalized "name=argument" tokens, so spacing doesn't make two chains look different.
+        self.tokens = ["=".join(part.strip() for part in token.split("=", 1))
+                       for token in re.split(r"->|,", chain) if token.strip()]
+        self.step_names = [token.partition("=")[0].strip() for token in self.tokens]
+        self.steps = [self._build_step(token) for token in self.tokens]
+
+    @staticmethod
+    def _build_step(token):
+        name, _, arg = token.strip().partition("=")
+        name = name.strip()
+        if name not in STEPS:
+            raise ValueError(f"Unknown correction '{name}'. Available: {', '.join(sorted(STEPS))}")
+        if name in STEPS_WITH_ARGUMENT and not arg:
+            raise ValueError(f"Correction '{name}' needs a value, e.g. {name}=1.2")
+        return STEPS[name](arg.strip() or None)
+
+    def apply(self, image):
+        for name, step in zip(self.step_names, self.steps):
+            with stage("step:" + name):
+                image = step(image, self.options)
+        return image
+
+    def run_file(self, image_path, output_dir=None, output_format=None, quality=95):
+        """Decodes `image_path` once, runs the chain and writes the result once. Returns the output path."""
+        result = self.apply(get_image_cache().get(image_path))
+        return write_image(result, output_path_for(image_path, output_dir, output_format), quality)
+
+
+def write_image(image, output_path, quality=95):
+    with stage("encode") as record, atomic_output(output_path) as tmp_path:
+        if not cv2.imwrite(tmp_path, image, encode_params(output_path, quality)):
+            raise IOError(f"Could not write {output_path}")
+        record.nbytes = os.path.getsize(tmp_path)
+    return output_path
+
+
+def encode_params(output_path, quality):
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if ext == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if ext == ".png":
+        # Map quality 0-100 onto zlib effort 9-0: higher quality means faster, larger files.
+        return [cv2.IMWRITE_PNG_COMPRESSION, max(0, min(9, 9 - int(quality) // 11))]
+    return []
+
+
+def collect_images(sources):
+    """Expands files, directories and glob patterns into a sorted list of image paths."""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            candidates = [os.path.join(source, name) for name in os.listdir(source)]
+        else:
+            candidates = glob.glob(source)
+        paths.extend(path for path in candidates
+                     if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(set(paths))
+
+
+def process_file(image_path, chain, output_dir=None, output_format=None, quality=95, memory_budget=None):
+    return Pipeline(chain, memory_budget).run_file(image_path, output_dir, output_format, quality)
+
+
+# StagedExecutor stages for process_file jobs. Frames are decoded outside the image cache so
+# only the images queued between stages are held in memory.
+PIPELINE_STAGES = (
+    lambda job: decode(job[0]),
+    lambda job, image: Pipeline(job[1], job[5]).apply(image),
+    lambda job, result: write_image(result, output_path_for(job[0], job[2], job[3]), job[4]),
+)
+
+
+def job_params(job):
+    # The memory budget only changes how the work is tiled, not the result.
+    _, chain, _, output_format, quality, _ = job
+    return {"chain": " -> ".join(Pipeline(chain).tokens), "format": output_format, "quality": quality}
+
+
+def plan_batch(sources, chain, output_dir=None, output_format=None, quality=95, memory_budget=None,
+               force=False, dry_run=False):
+    """Returns the JobPlan that separates images to process from those whose outputs are current."""
+    Pipeline(chain)  # Fail fast on a malformed chain before starting any workers.
+    jobs = [(path, chain, output_dir, output_format, quality, memory_budget) for path in collect_images(sources)]
+    return JobPlan(jobs, lambda job: output_dir_for(job[0], job[2]), job_params, force, create=not dry_run)
+
+
+def run_batch(sources, chain, output_dir=None, output_format=None, quality=95,
+              workers=None, on_result=None, memory_budget=None, overlap_io=False, io_threads=2, queue_depth=4,
+              force=False):
+    """Runs `chain` over every new or changed image in `sources` and returns the BatchReport.
+
+    Images go to a process pool, or with `overlap_io` through a StagedExecutor so decoding and
+    encoding overlap the corrections. `force` also redoes images whose outputs are current.
+    """
+    plan = plan_batch(sources, chain, output_dir, output_format, quality, memory_budget, force)
+    if overlap_io:
+        executor = StagedExecutor(PIPELINE_STAGES, workers, io_threads, queue_depth)
+    else:
+        executor = BatchExecutor(workers, task=process_file)
+    try:
+        return run_incremental(executor, plan, on_result)
+    finally:
+        executor.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m image_processing",
+        description="Run a chain of corrections over a set of images without the GUI.",
+        epilog=f"Available corrections: {', '.join(sorted(STEPS))}",
+    )
+    parser.add_argument("sources", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("--chain", required=True,
+                        help="ordered corrections, e.g. 'skew-crop -> unify-exposure -> brightness=1.1 -> aspect=16:9'")
+    parser.add_argument("-o", "--output-dir", default=None, help="output directory (default: processed/ next to each input)")
+    parser.add_argument("-f", "--format", choices=sorted(OUTPUT_FORMATS), default=None,
+                        help="output format (default: same as input)")
+    parser.add_argument("-q", "--quality", type=int, default=95, help="JPEG/WebP quality, 0-100")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--memory-budget", type=int, default=None, metavar="MB",
+                        help="run blur, exposure and upscale in strips or tiles with about this much working "
+                             "memory per worker; the upscaled image goes to a temporary file, the decoded input "
+                             "and steps after upscale still use full-size arrays")
+    add_run_options(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        Pipeline(args.chain)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    memory_budget = args.memory_budget * 1024 * 1024 if args.memory_budget else None
+    if args.dry_run:
+        print_plan(plan_batch(args.sources, args.chain, args.output_dir, args.format, args.quality,
+                              memory_budget, args.force, dry_run=True))
+        return 0
+    report = run_batch(args.sources, args.chain, args.output_dir, args.format, args.quality,
+                       args.workers, report_progress, memory_budget,
+                       args.overlap_io, args.io_threads, args.queue_depth, args.force)
+    print_report(report)
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# One row per image. eyes_found is 0 only when faces were found without open eyes (see filter_closed_eyes).
+FEATURES = np.dtype([
+    ("sharpness", np.float64),
+    ("exposure", np.float64),
+    ("eyes_open", np.float64),
+    ("eyes_found", np.float64),
+    ("overlap", np.float64),
+    ("resolution", np.float64),
+])
+
+# Features whose scale depends on the content are log-scaled and min-max normalized within each
+# group; the others are already in [0, 1] and keep their absolute value.
+RELATIVE_FEATURES = ("sharpness", "resolution")
+
+# Negative weights penalize a feature.
+DEFAULT_WEIGHTS = {"sharpness": 1.0, "exposure": 0.5, "eyes_open": 2.0, "eyes_found": 0.0,
+                   "overlap": -1.0, "resolution": 0.25}
+
+
+def normalize(features, group_ids):
+    """Returns {feature: values in [0, 1]} for rows sorted by group id."""
+    boundaries = np.r_[True, group_ids[1:] != group_ids[:-1]]
+    starts = np.flatnonzero(boundaries)
+    row_group = np.cumsum(boundaries) - 1
+    normalized = {}
+    for name in FEATURES.names:
+        values = features[name]
+        if name in RELATIVE_FEATURES:
+            values = np.log1p(np.maximum(values, 0))
+            low = np.minimum.reduceat(values, starts)[row_group]
+            span = np.maximum.reduceat(values, starts)[row_group] - low
+            values = np.divide(values - low, span, out=np.zeros_like(values), where=span > 0)
+        normalized[name] = values
+    return normalized
+
+
+def score(features, group_ids, weights=None):
+    """Weighted sum of the normalized features of rows sorted by group id."""
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    normalized = normalize(features, group_ids)
+    total = np.zeros(len(features))
+    for name, weight in weights.items():
+        if weight:
+            total += weight * normalized[name]
+    return total
+
+
+class SelectionEngine:
+    """Ranks photos by a weighted combination of per-image features.
+
+    `extract(image_path)` returns one FEATURES row as a tuple; it runs once per image, so
+    ranking again with other weights or groups only redoes the vectorized scoring.
+    """
+
+    def __init__(self, extract, weights=None, max_workers=None):
+        self.extract = extract
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.paths = []
+        self.features = np.empty(0, dtype=FEATURES)
+        self._rows = {}
+
+    def add(self, image_paths):
+        """Extracts features of the images not seen yet. Returns the number extracted."""
+        new = [path for path in dict.fromkeys(os.path.abspath(p) for p in image_paths) if path not in self._rows]
+        if not new:
+            return 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            rows = list(pool.map(self.extract, new))
+        for path in new:
+            self._rows[path] = len(self.paths)
+            self.paths.append(path)
+        self.features = np.concatenate([self.features, np.array(rows, dtype=FEATURES)])
+        return len(new)
+
+    def features_for(self, image_paths):
+        self.add(image_paths)
+        return self.features[[self._rows[os.path.abspath(path)] for path in image_paths]]
+
+    def rank(self, groups, weights=None, k=1):
+        """Returns the top `k` paths of each group (lists of paths), best first, in one pass."""
+        groups = [list(group) for group in groups]
+        self.add(path for group in groups for path in group)
+        members = [path for group in groups for path in group]
+        if not members:
+            return [[] for _ in groups]
+        rows = np.array([self._rows[os.path.abspath(path)] for path in members])
+        group_ids = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+        scores = score(self.features[rows], group_ids, dict(self.weights, **(weights or {})))
+        # Best first within each group, then the first k of every group.
+        order = np.lexsort((-scores, group_ids))
+        starts = np.searchsorted(group_ids[order], np.arange(len(groups)))
+        position = np.arange(len(order)) - starts[group_ids[order]]
+        picked = order[position < k]
+        ranked = [[] for _ in groups]
+        for index in picked:
+            ranked[group_ids[index]].append(members[index])
+        return ranked
+
+    def best(self, image_paths, weights=None):
+        ranked = self.rank([image_paths], weights)[0]
+        return ranked[0] if ranked else None
@@ -0,0 +1,36 @@
+import cv2
+import numpy as np
+
+
+# Scores are computed on a proxy with this long side so they are comparable across resolutions.
+SHARPNESS_SIDE = 1024
+FOCUS_GRID = (8, 8)
+
+
+def sharpness(gray):
+    """Variance of the Laplacian of a uint8 grayscale image, using an int16 Laplacian."""
+    # uint8 input keeps the 3x3 Laplacian within +-1020, so int16 holds it exactly and
+    # meanStdDev accumulates in double without a float64 copy of the frame.
+    laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+    _, std = cv2.meanStdDev(laplacian)
+    return float(std[0, 0] ** 2)
+
+
+def focus_map(gray, grid=FOCUS_GRID):
+    """Laplacian variance of each cell of a rows x cols grid over the image, as a float array."""
+    cols, rows = grid
+    laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+    h, w = laplacian.shape
+    cell_h, cell_w = h // rows, w // cols
+    cells = laplacian[:cell_h * rows, :cell_w * cols].astype(np.float32)
+    cells = cells.reshape(rows, cell_h, cols, cell_w)
+    return cells.var(axis=(1, 3))
+
+
+def subject_sharpness(focus, percentile=90):
+    """Sharpness of the best-focused part of the frame.
+
+    A portrait with a sharp subject and a blurred (bokeh) background has a low global score but
+    a high score here; a shaken or misfocused shot is low everywhere.
+    """
+    return float(np.percentile(focus, percentile))
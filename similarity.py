@@ -0,0 +1,134 @@
+import cv2
+import numpy as np
+
+from image_cache import get_image_cache
+from thumbnails import load_thumbnail
+
+
+HASH_PROXY_SIDE = 256
+DEFAULT_THRESHOLD = 10
+BLOCK_SIZE = 1024
+
+
+def dhash(gray):
+    """64-bit difference hash of a grayscale image as a numpy uint64."""
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits.ravel()).view(">u8")[0].astype(np.uint64)
+
+
+def popcount(values):
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(values.shape + (64,)).sum(axis=-1, dtype=np.uint8)
+
+
+def hamming_distances(hashes, others):
+    """Returns the len(hashes) x len(others) matrix of Hamming distances between two hash arrays."""
+    return popcount(np.bitwise_xor(hashes[:, None], others[None, :]))
+
+
+def similar_pairs(hashes, threshold):
+    """Index arrays (i, j) of pairs that connect the same images as all pairs within `threshold` bits.
+
+    Each image is paired with its first match (the lowest index within the threshold, which may
+    be itself). A matching pair whose two images have the same first match is left out, since both
+    already connect through it, so a burst of near-identical shots yields about one pair per shot
+    rather than one per pair of shots.
+    """
+    count = len(hashes)
+    columns = np.arange(count)
+    # Compare in blocks so thousands of images never need the full n x n matrix at once. Rows
+    # with matches besides the image itself are kept bit-packed for the second pass.
+    candidates = []
+    first_match = np.empty(count, dtype=np.intp)
+    for start in range(0, count, BLOCK_SIZE):
+        matches = hamming_distances(hashes[start:start + BLOCK_SIZE], hashes) <= threshold
+        first_match[start:start + len(matches)] = matches.argmax(axis=1)
+        rows = np.flatnonzero(np.count_nonzero(matches, axis=1) > 1)
+        candidates.append((rows + start, np.packbits(matches[rows], axis=1)))
+
+    linked = first_match != columns
+    first, second = [columns[linked]], [first_match[linked]]
+    for rows, bits in candidates:
+        matches = np.unpackbits(bits, axis=1, count=count).view(bool)
+        matches &= first_match[rows, None] != first_match[None, :]
+        pair_rows, cols = np.nonzero(matches)
+        first.append(rows[pair_rows])
+        second.append(cols)
+    return np.concatenate(first), np.concatenate(second)
+
+
+def connected_labels(count, first, second):
+    """Labels each of `count` elements with the smallest index of its connected component.
+
+    Edges are the pairs (first[k], second[k]). Each round hooks the root of the larger label of
+    every edge onto the smaller one and then jumps every element straight to its root, all as
+    array operations, until no edge joins two roots.
+    """
+    labels = np.arange(count)
+    while True:
+        low = np.minimum(labels[first], labels[second])
+        hooked = labels.copy()
+        np.minimum.at(hooked, labels[first], low)
+        np.minimum.at(hooked, labels[second], low)
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, labels):
+            return labels
+        labels = hooked
+
+
+class SimilarityIndex:
+    """Perceptual-hash index that groups near-duplicate photos such as burst shots."""
+
+    def __init__(self):
+        self.paths = []
+        self.hashes = np.empty(0, dtype=np.uint64)
+        # Absolute path -> position, and the (path, mtime, size) key each hash was computed for.
+        self._positions = {}
+        self._keys = []
+
+    def add(self, image_path):
+        key = get_image_cache().make_key(image_path)
+        position = self._positions.get(key[0])
+        if position is not None and self._keys[position] == key:
+            return
+        # A draft-decoded proxy is plenty for a 9x8 hash and keeps full frames out of the image cache.
+        image_hash = dhash(np.asarray(load_thumbnail(image_path, HASH_PROXY_SIDE).convert("L")))
+        if position is None:
+            self._positions[key[0]] = len(self.paths)
+            self.paths.append(image_path)
+            self._keys.append(key)
+            self.hashes = np.append(self.hashes, image_hash)
+        else:
+            self._keys[position] = key
+            self.hashes[position] = image_hash
+
+    def add_many(self, image_paths):
+        for image_path in image_paths:
+            self.add(image_path)
+
+    def groups(self, image_paths=None, threshold=DEFAULT_THRESHOLD, min_size=2):
+        """Clusters images whose hashes differ by at most `threshold` bits.
+
+        Works on `image_paths` (hashing any that are missing) or on the whole index. Returns a
+        list of path lists, largest groups first.
+        """
+        if image_paths is not None:
+            self.add_many(image_paths)
+            positions = np.array([self._positions[get_image_cache().make_key(p)[0]] for p in image_paths],
+                                 dtype=np.intp)
+        else:
+            positions = np.arange(len(self.paths))
+        labels = connected_labels(len(positions), *similar_pairs(self.hashes[positions], threshold))
+
+        order = np.argsort(labels, kind="stable")
+        starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+        groups = [[self.paths[positions[i]] for i in members] for members in np.split(order, starts[1:])
+                  if len(members) >= min_size]
+        return sorted(groups, key=len, reverse=True)
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+
+from image_cache import downscale
+
+
+# proxy: long side of the coarse pass, refine_side: long side of the refinement pass,
+# step: angular resolution of the refinement in degrees.
+SKEW_MODES = {
+    "fast": {"proxy": 512, "refine_side": 1024, "step": 0.1},
+    "accurate": {"proxy": 1024, "refine_side": 3072, "step": 0.02},
+}
+
+COARSE_STEP = 0.5
+REFINE_BAND = 1.5
+MAX_LINES = 64
+# Lines this close to the ends of the search range pile up in the edge bins of the Hough
+# accumulator on textured frames (foliage, noise) and are not a tilted horizon.
+LIMIT_MARGIN = 1.0
+
+
+def auto_canny(gray, sigma=0.33):
+    median = float(np.median(gray))
+    low = int(max(0, (1.0 - sigma) * median))
+    high = int(min(255, (1.0 + sigma) * median))
+    return cv2.Canny(gray, low, max(high, low + 1), apertureSize=3)
+
+
+def hough_angles(edges, step, min_angle, max_angle, min_length_ratio):
+    """Returns skew angles (degrees, strongest first) of near-horizontal lines in `edges`."""
+    h, w = edges.shape[:2]
+    # Votes are counted in edge pixels, so the threshold has to follow the image width;
+    # a fixed value finds nothing on small images and thousands of lines on large ones.
+    threshold = max(20, int(w * min_length_ratio))
+    lines = cv2.HoughLines(edges, 1, np.deg2rad(step), threshold,
+                           min_theta=np.deg2rad(90 + min_angle), max_theta=np.deg2rad(90 + max_angle))
+    if lines is None:
+        return np.empty(0)
+    return np.degrees(lines[:MAX_LINES, 0, 1]) - 90
+
+
+def estimate_skew(gray, mode="fast", max_angle=45.0, gray_at=None):
+    """Estimates the skew of a grayscale image as (angle in degrees, confidence in [0, 1]).
+
+    A coarse angle is found on a small proxy and then refined in a narrow band around it on a
+    larger proxy. Angles within LIMIT_MARGIN of `max_angle` are rejected. `gray_at(max_side)`
+    may be passed to supply cached proxies.
+    """
+    if mode not in SKEW_MODES:
+        raise ValueError(f"Unknown skew mode '{mode}'. Available: {', '.join(SKEW_MODES)}")
+    settings = SKEW_MODES[mode]
+    gray_at = gray_at or (lambda max_side: downscale(gray, max_side))
+
+    coarse = hough_angles(auto_canny(gray_at(settings["proxy"])), COARSE_STEP,
+                          -max_angle, max_angle, min_length_ratio=0.25)
+    limit = max_angle - LIMIT_MARGIN
+    coarse = coarse[np.abs(coarse) < limit]
+    if coarse.size == 0:
+        return 0.0, 0.0
+    coarse_angle = float(np.median(coarse[:8]))
+    agreeing = np.count_nonzero(np.abs(coarse - coarse_angle) <= 1.0)
+    # Many lines that agree with each other give a trustworthy angle; a lone line does not.
+    confidence = float(agreeing / coarse.size * min(1.0, agreeing / 5))
+
+    refined = hough_angles(auto_canny(gray_at(settings["refine_side"])), settings["step"],
+                           max(-limit, coarse_angle - REFINE_BAND), min(limit, coarse_angle + REFINE_BAND),
+                           min_length_ratio=0.2)
+    refined = refined[np.abs(refined) < limit]
+    if refined.size == 0:
+        return coarse_angle, confidence
+    return float(np.median(refined[:8])), confidence
@@ -0,0 +1,94 @@
+from fractions import Fraction
+
+import cv2
+import numpy as np
+
+
+# The importance map is built on a proxy with this long side; crop positions are searched on it.
+SALIENCY_SIDE = 256
+SPECTRAL_SIDE = 64
+# Share of the map's total weight given to each detected face, on top of the saliency.
+FACE_WEIGHT = 1.0
+# Faces are widened by this fraction of their size on every side to keep hair and chin.
+FACE_MARGIN = 0.3
+# Ratios offered for trimming, as (label, width / height)
+COMMON_RATIOS = (("16:9", 16 / 9), ("4:3", 4 / 3), ("1:1", 1.0), ("2:3", 2 / 3))
+
+
+def parse_ratio(value):
+    """Parses "16:9" or "1.78" into a width / height ratio."""
+    if ":" in value:
+        w, h = value.split(":", 1)
+        return float(w) / float(h)
+    return float(value)
+
+
+def ratio_label(aspect_ratio):
+    """Short file-name friendly form of a ratio, e.g. 16x9."""
+    fraction = Fraction(aspect_ratio).limit_denominator(20)
+    return f"{fraction.numerator}x{fraction.denominator}"
+
+
+def spectral_saliency(gray):
+    """Spectral residual saliency (Hou & Zhang) of a grayscale image, as float32 of the same size."""
+    small = cv2.resize(gray, (SPECTRAL_SIDE, SPECTRAL_SIDE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    spectrum = np.fft.fft2(small)
+    log_amplitude = np.log(np.abs(spectrum) + 1e-6).astype(np.float32)
+    residual = log_amplitude - cv2.blur(log_amplitude, (3, 3))
+    saliency = np.abs(np.fft.ifft2(np.exp(residual + 1j * np.angle(spectrum)))) ** 2
+    saliency = cv2.GaussianBlur(saliency.astype(np.float32), (0, 0), 2.5)
+    return cv2.resize(saliency, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+
+def importance_map(gray, faces=(), scale=1.0, face_weight=FACE_WEIGHT):
+    """Saliency of a small grayscale proxy plus a uniform block of weight on every face.
+
+    `faces` are (x, y, w, h) boxes in the coordinates of an image `1 / scale` times larger than
+    `gray`. The map sums to 1 + face_weight * len(faces).
+    """
+    importance = spectral_saliency(gray)
+    importance /= max(float(importance.sum()), 1e-12)
+    h, w = importance.shape
+    for x, y, fw, fh in np.asarray(faces, dtype=np.float64).reshape(-1, 4) * scale:
+        x0, y0 = max(0, int(x - fw * FACE_MARGIN)), max(0, int(y - fh * FACE_MARGIN))
+        x1, y1 = min(w, int(np.ceil(x + fw * (1 + FACE_MARGIN)))), min(h, int(np.ceil(y + fh * (1 + FACE_MARGIN))))
+        if x1 > x0 and y1 > y0:
+            importance[y0:y1, x0:x1] += face_weight / ((x1 - x0) * (y1 - y0))
+    return importance
+
+
+def summed_area_table(importance):
+    return cv2.integral(importance, sdepth=cv2.CV_64F)
+
+
+def crop_size(width, height, aspect_ratio):
+    """Largest (w, h) with the given ratio that fits in the frame."""
+    if width / height > aspect_ratio:
+        return max(1, min(width, int(round(height * aspect_ratio)))), height
+    return width, max(1, min(height, int(round(width / aspect_ratio))))
+
+
+def best_window(sat, size, aspect_ratio):
+    """Returns the (x, y, w, h) crop of an image of `size` (w, h) that keeps the most importance.
+
+    `sat` is the summed-area table of the importance map of a proxy of the image, so every
+    candidate position costs four lookups. Ties go to the most centered window.
+    """
+    width, height = size
+    crop_w, crop_h = crop_size(width, height, aspect_ratio)
+    map_h, map_w = sat.shape[0] - 1, sat.shape[1] - 1
+    scale = map_w / width
+    window_w = min(map_w, max(1, int(round(crop_w * scale))))
+    window_h = min(map_h, max(1, int(round(crop_h * scale))))
+
+    xs = np.arange(map_w - window_w + 1)
+    ys = np.arange(map_h - window_h + 1)[:, None]
+    scores = sat[ys + window_h, xs + window_w] - sat[ys, xs + window_w] - sat[ys + window_h, xs] + sat[ys, xs]
+    # A slight pull towards the center so flat regions keep the old centered crop.
+    offset = np.abs(xs - (map_w - window_w) / 2) + np.abs(ys - (map_h - window_h) / 2)
+    scores = scores - offset * (scores.max() * 1e-6 + 1e-12)
+    row, col = np.unravel_index(int(np.argmax(scores)), scores.shape)
+
+    x = min(width - crop_w, max(0, int(round(col / scale))))
+    y = min(height - crop_h, max(0, int(round(row / scale))))
+    return x, y, crop_w, crop_h
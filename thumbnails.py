@@ -0,0 +1,116 @@
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+THUMBNAIL_SIZE = 200
+# Embedded EXIF thumbnails are usually 160x120; accept them when they are close to the target.
+MIN_EXIF_THUMBNAIL_RATIO = 0.8
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ai_image_app", "thumbnails")
+
+
+def exif_thumbnail(image):
+    """Returns the JPEG thumbnail embedded in the EXIF block of an opened image, or None."""
+    raw = image.info.get("exif")
+    if not raw:
+        return None
+    # The embedded thumbnail is a complete JPEG stream inside the APP1 segment.
+    start = raw.find(b"\xff\xd8", 6)
+    end = raw.rfind(b"\xff\xd9")
+    if start < 0 or end <= start:
+        return None
+    try:
+        thumbnail = Image.open(io.BytesIO(raw[start:end + 2]))
+        thumbnail.load()
+    except OSError:
+        return None
+    return thumbnail
+
+
+# EXIF orientation tag value -> transpose that displays the image upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def load_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """Decodes an upright RGB thumbnail of at most size x size pixels without decoding the full image."""
+    with Image.open(image_path) as image:
+        orientation = image.getexif().get(0x0112, 1)
+        thumbnail = exif_thumbnail(image)
+        if thumbnail is None or max(thumbnail.size) < size * MIN_EXIF_THUMBNAIL_RATIO:
+            # draft() lets the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding.
+            image.draft("RGB", (size, size))
+            thumbnail = image.convert("RGB")
+    thumbnail = thumbnail.convert("RGB")
+    thumbnail.thumbnail((size, size))
+    if orientation in ORIENTATION_TRANSPOSE:
+        thumbnail = thumbnail.transpose(ORIENTATION_TRANSPOSE[orientation])
+    return thumbnail
+
+
+class ThumbnailService:
+    """Builds thumbnails on a background thread pool, backed by a persistent on-disk cache."""
+
+    def __init__(self, cache_dir=None, size=THUMBNAIL_SIZE, max_workers=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1),
+                                            thread_name_prefix="thumbnail")
+
+    def cache_path(self, image_path):
+        stat = os.stat(image_path)
+        key = f"{os.path.abspath(image_path)}:{stat.st_mtime_ns}:{stat.st_size}:{self.size}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".jpg")
+
+    def get(self, image_path):
+        cache_path = self.cache_path(image_path)
+        if os.path.exists(cache_path):
+            try:
+                with Image.open(cache_path) as cached:
+                    return cached.convert("RGB")
+            except OSError:
+                pass
+        thumbnail = load_thumbnail(image_path, self.size)
+        self._store(cache_path, thumbnail)
+        return thumbnail
+
+    def _store(self, cache_path, thumbnail):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                thumbnail.save(f, "JPEG", quality=85)
+            os.replace(tmp_path, cache_path)
+        except OSError as exc:
+            print(f"Could not cache thumbnail {cache_path}: {exc}")
+
+    def submit(self, image_path, callback):
+        """Builds the thumbnail in the background and calls `callback(image_path, thumbnail, error)`."""
+        def done(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            callback(image_path, None if error else future.result(), error)
+
+        future = self._executor.submit(self.get, image_path)
+        future.add_done_callback(done)
+        return future
+
+    def shutdown(self, wait=False):
+        """Drops queued thumbnails; with `wait`, also waits for the ones being built."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
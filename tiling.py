@@ -0,0 +1,153 @@
+import tempfile
+
+import cv2
+import numpy as np
+
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Rough working-set bytes per input pixel of each tiled operation, used to size strips and tiles.
+LAPLACIAN_BYTES_PER_PIXEL = 4 * 3
+CLAHE_BYTES_PER_PIXEL = 4 * 8
+SUPERRES_BYTES_PER_PIXEL = 64 * 4 * 6
+
+
+def disk_array(shape, dtype, directory=None):
+    """Array backed by an unlinked temporary file (in $TMPDIR unless `directory` is given).
+
+    Its pages are written back and dropped by the kernel as needed, so an output larger than
+    the memory budget can be filled strip by strip and then encoded from it.
+    """
+    with tempfile.TemporaryFile(dir=directory) as f:
+        return np.memmap(f, dtype=dtype, mode="w+", shape=shape)
+
+
+def strip_height(width, bytes_per_pixel, budget, multiple=1, minimum=1):
+    rows = budget // max(1, width * bytes_per_pixel)
+    rows = max(minimum, rows) // multiple * multiple
+    return max(multiple, rows)
+
+
+def strips(height, rows, halo=0):
+    """Yields (y0, y1, top, bottom): the strip [y0, y1) plus how many halo rows to read around it."""
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        yield y0, y1, min(halo, y0), min(halo, height - y1)
+
+
+def laplacian_variance(gray, budget=DEFAULT_MEMORY_BUDGET):
+    """Variance of the Laplacian of `gray`, computed strip by strip in float32.
+
+    Each strip is read with a one-row halo so the result matches a full-frame cv2.Laplacian.
+    """
+    h, w = gray.shape[:2]
+    rows = strip_height(w, LAPLACIAN_BYTES_PER_PIXEL, budget)
+    total = total_sq = 0.0
+    for y0, y1, top, bottom in strips(h, rows, halo=1):
+        strip = cv2.Laplacian(gray[y0 - top:y1 + bottom], cv2.CV_32F)[top:top + y1 - y0]
+        mean, std = cv2.meanStdDev(strip)
+        n = strip.size
+        total += mean[0, 0] * n
+        total_sq += (std[0, 0] ** 2 + mean[0, 0] ** 2) * n
+    count = gray.shape[0] * gray.shape[1]
+    mean = total / count
+    return total_sq / count - mean * mean
+
+
+def _clahe_lut(hist, clip_limit, tile_area):
+    # Same clipping, redistribution and scaling as OpenCV's CLAHE_CalcLut_Body.
+    hist = hist.astype(np.int64)
+    limit = max(int(clip_limit * tile_area / 256), 1)
+    clipped = int(np.clip(hist - limit, 0, None).sum())
+    hist = np.minimum(hist, limit)
+    batch, residual = divmod(clipped, 256)
+    hist += batch
+    if residual:
+        step = max(256 // residual, 1)
+        hist[np.arange(0, 256, step)[:residual]] += 1
+    lut = np.cumsum(hist) * (255.0 / tile_area)
+    return np.clip(np.rint(lut), 0, 255).astype(np.uint8)
+
+
+def clahe(gray, clip_limit=3.0, grid=(8, 8), budget=DEFAULT_MEMORY_BUDGET):
+    """Contrast-limited adaptive histogram equalization of a uint8 image in two streaming passes.
+
+    The first pass builds the per-tile histograms strip by strip, the second interpolates the
+    tile lookup tables for one strip at a time, so only the 8 x 8 x 256 tables and one strip of
+    working memory are held at once. The result matches cv2.createCLAHE(...).apply(gray).
+    """
+    h, w = gray.shape[:2]
+    tiles_x, tiles_y = grid
+    pad_right = pad_bottom = 0
+    if w % tiles_x or h % tiles_y:
+        # Like OpenCV, pad with BORDER_REFLECT_101 before taking histograms (by a full tile
+        # count on an axis that already divides evenly).
+        pad_right, pad_bottom = tiles_x - w % tiles_x, tiles_y - h % tiles_y
+    tile_w, tile_h = (w + pad_right) // tiles_x, (h + pad_bottom) // tiles_y
+    tile_area = tile_w * tile_h
+
+    luts = np.empty((tiles_y, tiles_x, 256), dtype=np.uint8)
+    rows = strip_height(w, CLAHE_BYTES_PER_PIXEL, budget, multiple=tile_h)
+    for y0 in range(0, tiles_y * tile_h, rows):
+        y1 = min(tiles_y * tile_h, y0 + rows)
+        strip = _padded_rows(gray, y0, y1, pad_right)
+        for ty in range(y0 // tile_h, y1 // tile_h):
+            band = strip[ty * tile_h - y0:(ty + 1) * tile_h - y0]
+            for tx in range(tiles_x):
+                tile = band[:, tx * tile_w:(tx + 1) * tile_w]
+                hist = cv2.calcHist([np.ascontiguousarray(tile)], [0], None, [256], [0, 256]).ravel()
+                luts[ty, tx] = _clahe_lut(hist, clip_limit, tile_area)
+
+    out = np.empty_like(gray)
+    txf = np.arange(w) / tile_w - 0.5
+    tx1 = np.floor(txf).astype(int)
+    xa = (txf - tx1).astype(np.float32)
+    tx2 = np.minimum(tx1 + 1, tiles_x - 1)
+    tx1 = np.maximum(tx1, 0)
+    rows = strip_height(w, CLAHE_BYTES_PER_PIXEL, budget)
+    for y0, y1, _, _ in strips(h, rows):
+        tyf = np.arange(y0, y1) / tile_h - 0.5
+        ty1 = np.floor(tyf).astype(int)
+        ya = (tyf - ty1).astype(np.float32)[:, None]
+        ty2 = np.minimum(ty1 + 1, tiles_y - 1)[:, None]
+        ty1 = np.maximum(ty1, 0)[:, None]
+        values = gray[y0:y1]
+        top = luts[ty1, tx1, values] * (1 - xa) + luts[ty1, tx2, values] * xa
+        bottom = luts[ty2, tx1, values] * (1 - xa) + luts[ty2, tx2, values] * xa
+        out[y0:y1] = np.clip(np.rint(top * (1 - ya) + bottom * ya), 0, 255)
+    return out
+
+
+def _padded_rows(gray, y0, y1, pad_right):
+    h = gray.shape[0]
+    if y1 <= h and not pad_right:
+        return gray[y0:y1]
+    # Rows past the bottom edge mirror the rows above it (BORDER_REFLECT_101).
+    index = np.arange(y0, y1)
+    index = np.where(index < h, index, 2 * (h - 1) - index)
+    return cv2.copyMakeBorder(gray[index], 0, 0, 0, pad_right, cv2.BORDER_REFLECT_101)
+
+
+def upscale_tiled(image, upsample, scale, budget=DEFAULT_MEMORY_BUDGET, halo=8, out=None):
+    """Runs `upsample` (e.g. a DnnSuperResImpl's upsample) tile by tile and writes the result in strips.
+
+    Each tile is read with `halo` extra pixels on every side that are cut away after upscaling,
+    which hides the seams of the network's receptive field. The result goes to `out` if given,
+    otherwise to a disk_array, so the full upscaled image never has to fit in RAM.
+    """
+    h, w = image.shape[:2]
+    side = int(max(16, (budget / SUPERRES_BYTES_PER_PIXEL) ** 0.5)) - 2 * halo
+    side = max(16, side)
+    if out is None:
+        out = disk_array((h * scale, w * scale) + image.shape[2:], image.dtype)
+    for y0 in range(0, h, side):
+        y1 = min(h, y0 + side)
+        top, bottom = min(halo, y0), min(halo, h - y1)
+        for x0 in range(0, w, side):
+            x1 = min(w, x0 + side)
+            left, right = min(halo, x0), min(halo, w - x1)
+            tile = np.ascontiguousarray(image[y0 - top:y1 + bottom, x0 - left:x1 + right])
+            result = upsample(tile)
+            out[y0 * scale:y1 * scale, x0 * scale:x1 * scale] = \
+                result[top * scale:(top + y1 - y0) * scale, left * scale:(left + x1 - x0) * scale]
+    return out